@@ -0,0 +1,256 @@
+"""
+Emulates the Hack computer: a 32K ROM of instructions, a 32K RAM and
+the A, D and PC registers.
+
+Process:
+- Load a program (.hack text or packed binary image) into the ROM.
+- Instructions are decoded once into python source. Starting from any
+  PC, the straight-line run of instructions up to the next jump is
+  compiled into a single python function (a block) and cached.
+- Running the machine calls block after block, each returning the
+  next PC and the new A and D registers.
+
+All register and memory values are unsigned 16-bit ints; use `signed`
+to read them as two's complement.
+"""
+
+from array import array
+from pathlib import Path
+import sys
+
+ROM_SIZE = 32768
+RAM_SIZE = 32768
+SCREEN = 16384
+KBD = 24576
+MAX_BLOCK = 64
+
+# Python expressions for the ALU computations, indexed by the a+c bits.
+# The flag marks expressions that can leave the 16-bit range.
+computations = {
+    0b0101010: ('0', False),        0b0111111: ('1', False),
+    0b0111010: ('65535', False),    0b0001100: ('d', False),
+    0b0110000: ('a', False),        0b1110000: ('ram[a]', False),
+    0b0001101: ('~d', True),        0b0110001: ('~a', True),
+    0b1110001: ('~ram[a]', True),   0b0001111: ('-d', True),
+    0b0110011: ('-a', True),        0b1110011: ('-ram[a]', True),
+    0b0011111: ('d+1', True),       0b0110111: ('a+1', True),
+    0b1110111: ('ram[a]+1', True),  0b0001110: ('d-1', True),
+    0b0110010: ('a-1', True),       0b1110010: ('ram[a]-1', True),
+    0b0000010: ('d+a', True),       0b1000010: ('d+ram[a]', True),
+    0b0010011: ('d-a', True),       0b1010011: ('d-ram[a]', True),
+    0b0000111: ('a-d', True),       0b1000111: ('ram[a]-d', True),
+    0b0000000: ('d&a', False),      0b1000000: ('d&ram[a]', False),
+    0b0010101: ('d|a', False),      0b1010101: ('d|ram[a]', False),
+}
+
+# Jump conditions on the unsigned 16-bit ALU output v
+jumps = {
+    1: '0 < v < 32768', 2: 'v == 0', 3: 'v < 32768',
+    4: 'v >= 32768', 5: 'v != 0', 6: 'v == 0 or v >= 32768', 7: 'True',
+}
+
+def signed(v):
+    "Read an unsigned 16-bit value as two's complement."
+    return v - 65536 if v & 0x8000 else v
+
+def alu(c, x, y):
+    "The full Hack ALU, for computations not in `computations`."
+    if c & 0b100000: x = 0
+    if c & 0b010000: x = ~x
+    if c & 0b001000: y = 0
+    if c & 0b000100: y = ~y
+    out = x + y if c & 0b000010 else x & y
+    if c & 0b000001: out = ~out
+    return out & 0xFFFF
+
+def decode(instruction):
+    """Decode an instruction into lines of python source.
+
+    Returns:
+        (lines, jump) where jump is the condition source if the
+        instruction may jump, otherwise None.
+    """
+    if not instruction & 0x8000:
+        return [f'a = {instruction}'], None
+
+    comp = instruction >> 6 & 0b1111111
+    dest = instruction >> 3 & 0b111
+    jump = jumps.get(instruction & 0b111)
+    if comp in computations:
+        expr, mask = computations[comp]
+    else:
+        y = 'ram[a]' if comp & 0b1000000 else 'a'
+        expr, mask = f'alu({comp & 0b111111}, d, {y})', False
+    if mask: expr = f'({expr}) & 65535'
+
+    lines = []
+    if jump is not None and dest & 0b100:
+        lines.append('t = a')
+    if dest == 0b001 and jump is None:
+        lines.append(f'ram[a] = {expr}')
+    elif dest == 0b010 and jump is None:
+        lines.append(f'd = {expr}')
+    elif dest == 0b100 and jump is None:
+        lines.append(f'a = {expr}')
+    elif dest or (jump is not None and jump != 'True'):
+        lines.append(f'v = {expr}')
+        if dest & 0b001: lines.append('ram[a] = v')
+        if dest & 0b100: lines.append('a = v')
+        if dest & 0b010: lines.append('d = v')
+    return lines, jump
+
+class Computer:
+    def __init__(self, program=None):
+        self.rom = array('H', bytes(2*ROM_SIZE))
+        self.ram = [0]*RAM_SIZE
+        self.a = self.d = self.pc = 0
+        self.halted = False
+        self.steps = 0
+        self._clear_blocks()
+        if program is not None:
+            self.load(program)
+
+    def _clear_blocks(self):
+        self._blocks = [None]*ROM_SIZE
+        self._singles = [None]*ROM_SIZE
+
+    def load(self, program):
+        """Load a program into ROM and reset. `program` is a .hack file,
+        a little endian binary image (.bin) or a sequence of words."""
+        if isinstance(program, (str, Path)):
+            path = Path(program)
+            if path.suffix == '.hack':
+                with open(path, 'r') as f:
+                    program = [int(line, 2) for line in f if line.strip()]
+            else:
+                program = array('H', path.read_bytes())
+                if sys.byteorder != 'little': program.byteswap()
+        assert len(program) <= ROM_SIZE, 'Program does not fit in ROM'
+        self.rom = array('H', program)
+        self.rom.extend(bytes(2*(ROM_SIZE - len(program))))
+        self._clear_blocks()
+        self.reset()
+
+    def reset(self):
+        "Set the PC to 0. Registers and RAM keep their values."
+        self.pc = 0
+        self.halted = False
+
+    @property
+    def keyboard(self):
+        return self.ram[KBD]
+
+    @keyboard.setter
+    def keyboard(self, key):
+        self.ram[KBD] = key
+
+    def dump(self, start=0, end=None, signed_values=False):
+        "Return the RAM values in [start, end)."
+        values = self.ram[start:start+1 if end is None else end]
+        return [signed(v) for v in values] if signed_values else values
+
+    def _compile(self, pc, limit=MAX_BLOCK):
+        """Compile the instructions from `pc` up to the next jump into a
+        function block(a, d) -> (pc, a, d).
+
+        Returns:
+            (block, number of instructions, whether the block halts)
+        """
+        lines = []
+        n = 0
+        while n < limit and pc+n < ROM_SIZE:
+            code, jump = decode(self.rom[pc+n])
+            lines.extend(code)
+            n += 1
+            if jump is not None:
+                target = 't' if 't = a' in code else 'a'
+                if jump == 'True':
+                    lines.append(f'return {target}, a, d')
+                else:
+                    lines.append(f'if {jump}: return {target}, a, d')
+                    lines.append(f'return {(pc+n) % ROM_SIZE}, a, d')
+                break
+        else:
+            lines.append(f'return {(pc+n) % ROM_SIZE}, a, d')
+
+        src = 'def block(a, d, ram=ram, alu=alu):\n    ' + '\n    '.join(lines)
+        namespace = {'ram': self.ram, 'alu': alu}
+        exec(compile(src, f'<rom {pc}>', 'exec'), namespace)
+
+        # `@pc, 0;JMP` is the conventional infinite loop that ends a program
+        halts = n == 2 and self.rom[pc] == pc and self.rom[pc+1] == 0b1110101010000111
+        return namespace['block'], n, halts
+
+    def run(self, max_steps=None):
+        """Run until `max_steps` instructions have executed, or until the
+        program halts if there is no limit. Returns the number of
+        instructions executed."""
+        blocks, singles = self._blocks, self._singles
+        budget = float('inf') if max_steps is None else max_steps
+        pc, a, d = self.pc, self.a, self.d
+        executed = 0
+        try:
+            while executed < budget:
+                block = blocks[pc]
+                if block is None:
+                    block = blocks[pc] = self._compile(pc)
+                fn, n, halts = block
+                if halts:
+                    # Fast forward through the rest of the budget: the loop
+                    # alternates the PC between its two instructions.
+                    self.halted = True
+                    if budget == float('inf'): break
+                    remaining = budget - executed
+                    if remaining:
+                        a = pc
+                        if remaining % 2: pc += 1
+                    executed = budget
+                    break
+                if executed + n > budget:
+                    # Finish the budget one instruction at a time
+                    while executed < budget:
+                        single = singles[pc]
+                        if single is None:
+                            single = singles[pc] = self._compile(pc, limit=1)
+                        pc, a, d = single[0](a, d)
+                        executed += 1
+                    break
+                pc, a, d = fn(a, d)
+                executed += n
+        finally:
+            self.pc, self.a, self.d = pc, a, d
+            self.steps += executed
+        return executed
+
+    def step(self):
+        "Execute a single instruction (one clock cycle)."
+        return self.run(1)
+
+if __name__=='__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Hack computer emulator.')
+    parser.add_argument('filename', type=str,
+                        help='Program to run (.hack or little endian binary image).')
+    parser.add_argument('--steps', '-n', type=int, default=10**7,
+                        help='Maximum number of instructions to execute.')
+    parser.add_argument('--set', '-s', type=str, nargs='+', default=[],
+                        help='Initial RAM values as address=value.')
+    parser.add_argument('--dump', '-d', type=int, nargs=2, default=[0, 16],
+                        help='RAM range [start, end) to print after running.')
+
+    args = parser.parse_args()
+    computer = Computer(args.filename)
+    for assignment in args.set:
+        address, value = assignment.split('=')
+        computer.ram[int(address)] = int(value) & 0xFFFF
+
+    start = time.perf_counter()
+    executed = computer.run(args.steps)
+    elapsed = time.perf_counter() - start
+
+    print(f'{executed} instructions in {elapsed:.3f}s ({executed/max(elapsed, 1e-9):,.0f}/sec)'
+          + (', halted' if computer.halted else ''))
+    for i, v in enumerate(computer.dump(*args.dump, signed_values=True), args.dump[0]):
+        print(f'RAM[{i}] = {v}')
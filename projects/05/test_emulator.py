@@ -0,0 +1,63 @@
+from emulator import Computer, alu, signed
+from tst_runner import parse_script, run_script
+
+def test_add():
+    c = Computer('Add.hack')
+    assert c.run(6) == 6
+    assert c.dump(0, 3) == [5, 0, 0]
+    assert (c.a, c.d, c.pc) == (0, 5, 6)
+
+def test_max():
+    for x, y in [(3, 5), (23456, 12345)]:
+        c = Computer('Max.hack')
+        c.ram[0], c.ram[1] = x, y
+        c.run(100)
+        assert c.halted
+        assert c.ram[2] == max(x, y)
+
+def test_rect():
+    c = Computer('Rect.hack')
+    c.ram[0] = 4
+    c.run(1000)
+    assert c.halted
+    assert c.dump(16384, 16384+32*5, signed_values=True)[::32] == [-1, -1, -1, -1, 0]
+
+def test_step_budget():
+    c = Computer('Max.hack')
+    c.ram[0], c.ram[1] = 3, 5
+    for i in range(1, 8):
+        c.step()
+        assert c.steps == i
+    c.reset()
+    assert c.pc == 0 and signed(c.d) == 3-5
+
+def test_alu():
+    # Every computation table entry matches the ALU bits
+    c = Computer([0b1110111111001000])  # M=1
+    c.run(1)
+    assert c.ram[0] == 1
+    assert alu(0b010011, 7, 5) == 2             # D-A
+    assert signed(alu(0b000111, 7, 5)) == -2    # A-D
+    assert alu(0b000001, 7, 5) == 0xFFFF ^ 5    # !(D&A)
+
+def test_parse_script():
+    commands = parse_script("""load Add.hack, // comment
+        output-list RAM[0]%D1.6.1 /* block */ RAM[1]%D1.6.1;
+        repeat 3 { ticktock; } output;""")
+    assert commands == [['load', 'Add.hack'],
+                        ['output-list', 'RAM[0]%D1.6.1', 'RAM[1]%D1.6.1'],
+                        ('repeat', 3, [['ticktock']]), ['output']]
+
+def test_computer_scripts():
+    for script in ['ComputerAdd', 'ComputerMax', 'ComputerRect']:
+        run_script(script+'.tst', write_output=False)
+        run_script(script+'-external.tst', write_output=False)
+
+if __name__=='__main__':
+    test_add()
+    test_max()
+    test_rect()
+    test_step_budget()
+    test_alu()
+    test_parse_script()
+    test_computer_scripts()
@@ -0,0 +1,249 @@
+"""
+Runs CPU emulator test scripts (.tst) against the python Hack emulator
+and compares the output with the expected .cmp table.
+
+Supported commands:
+    load X.asm|X.hack, ROM32K load X.hack, output-file, compare-to,
+    output-list, output, set, tick, tock, ticktock, echo,
+    repeat [n] {...}, while <cond> {...}
+
+Readable and settable variables are time, reset, A/ARegister[],
+D/DRegister[], PC/PC[], RAM[i], RAM16K[i] and ROM32K[i].
+"""
+
+from pathlib import Path
+import re
+import sys
+
+from emulator import Computer, signed
+
+sys.path.append(str(Path(__file__).resolve().parent.parent/'06'))
+from assembler import assemble, remove_comments
+
+TOKENS = re.compile(r'"[^"]*"|[{},;!]|[^\s{},;!]+')
+COMMENTS = re.compile(r'//[^\n]*|/\*.*?\*/', re.S)
+OUTPUT_FORMAT = re.compile(r'(.+)%([BDXS])(\d+)\.(\d+)\.(\d+)$')
+CONDITIONS = {
+    '=': lambda x,y: x == y, '<>': lambda x,y: x != y,
+    '<': lambda x,y: x < y, '>': lambda x,y: x > y,
+    '<=': lambda x,y: x <= y, '>=': lambda x,y: x >= y,
+}
+
+class ScriptError(Exception):
+    pass
+
+class ComparisonFailure(Exception):
+    pass
+
+def parse_script(text):
+    """Parse a script into a list of commands. A command is a list of
+    words, or a ('repeat'|'while', argument, body) tuple."""
+    tokens = iter(TOKENS.findall(COMMENTS.sub('', text)))
+
+    def block(end=None):
+        commands, words = [], []
+        for token in tokens:
+            if token in ',;!':
+                if words: commands.append(words)
+                words = []
+            elif token == '{':
+                if words[0] == 'repeat':
+                    arg = int(words[1]) if len(words) > 1 else None
+                elif words[0] == 'while':
+                    arg = words[1:]
+                else:
+                    raise ScriptError(f'Unexpected block after {words}')
+                commands.append((words[0], arg, block(end='}')))
+                words = []
+            elif token == '}':
+                if end != '}': raise ScriptError('Unmatched "}"')
+                if words: commands.append(words)
+                return commands
+            else:
+                words.append(token)
+        if end is not None: raise ScriptError('Missing "}"')
+        if words: commands.append(words)
+        return commands
+
+    return block()
+
+def parse_value(value):
+    "Parse a script value: decimal, or %B/%X/%D prefixed."
+    base = {'%B': 2, '%X': 16, '%D': 10}.get(value[:2].upper())
+    if base is not None: value = value[2:]
+    return int(value, base or 10) & 0xFFFF
+
+def format_column(spec, value=None):
+    "Format a header (value is None) or value cell of an output-list entry."
+    m = OUTPUT_FORMAT.match(spec)
+    name, fmt, left, width, right = m.groups() if m else (spec, 'D', 1, 6, 1)
+    left, width, right = int(left), int(width), int(right)
+    if value is None:
+        total = left + width + right
+        name = name[:total]
+        pad = (total - len(name)) // 2
+        return ' '*pad + name + ' '*(total - len(name) - pad)
+
+    if fmt == 'S': body = str(value).ljust(width)
+    elif fmt == 'D': body = str(signed(value)).rjust(width)
+    elif fmt == 'B': body = format(value, '016b')[-width:].rjust(width)
+    else: body = format(value, '04X')[-width:].rjust(width)
+    return ' '*left + body + ' '*right
+
+def _match(expected, actual):
+    "Compare lines, where '*' in the expected line matches any character."
+    expected, actual = expected.rstrip(), actual.rstrip()
+    return len(expected) == len(actual) and all(
+        e == a or e == '*' for e, a in zip(expected, actual))
+
+class ScriptRunner:
+    def __init__(self, filename, write_output=True):
+        self.file = Path(filename)
+        self.dir = self.file.parent
+        self.write_output = write_output
+        self.computer = Computer()
+        self.time = 0
+        self.half_cycle = False
+        self.reset = 0
+        self.output_list = []
+        self.output_file = None
+        self.lines = []
+        self.compare = None
+        self.echo = []
+
+    def run(self):
+        "Run the script, raising `ComparisonFailure` on a mismatch."
+        try:
+            self._run(parse_script(self.file.read_text()))
+        finally:
+            if self.write_output and self.output_file is not None:
+                (self.dir/self.output_file).write_text(''.join(l+'\n' for l in self.lines))
+        return self.lines
+
+    def _run(self, commands):
+        for command in commands:
+            if isinstance(command, tuple):
+                kind, arg, body = command
+                if kind == 'repeat' and body == [['ticktock']] and arg and not self.reset:
+                    # Fast path for the common `repeat n { ticktock; }`
+                    self.computer.run(arg)
+                    self.time += arg
+                elif kind == 'repeat':
+                    count = 0
+                    while arg is None or count < arg:
+                        self._run(body)
+                        count += 1
+                else:
+                    while self._condition(arg):
+                        self._run(body)
+            else:
+                self._command(command)
+
+    def _condition(self, words):
+        left, op, right = words
+        return CONDITIONS[op](signed(self.get(left)), signed(parse_value(right)))
+
+    def _command(self, words):
+        cmd = words[0]
+        if cmd == 'load':
+            self._load(words[1])
+        elif cmd == 'ROM32K' and words[1] == 'load':
+            self._load(words[2])
+        elif cmd == 'output-file':
+            self.output_file = words[1]
+        elif cmd == 'compare-to':
+            with open(self.dir/words[1]) as f:
+                self.compare = f.read().splitlines()
+        elif cmd == 'output-list':
+            self.output_list = words[1:]
+            self._output('|' + '|'.join(format_column(s) for s in self.output_list) + '|')
+        elif cmd == 'output':
+            self._output('|' + '|'.join(format_column(s, self.get(s.split('%')[0]))
+                                        for s in self.output_list) + '|')
+        elif cmd == 'set':
+            self.set(words[1], parse_value(words[2]))
+        elif cmd == 'tick':
+            self.half_cycle = True
+        elif cmd in {'tock', 'ticktock'}:
+            self._cycle()
+        elif cmd == 'echo':
+            self.echo.append(' '.join(words[1:]).strip('"'))
+        elif cmd in {'clear-echo', 'breakpoint', 'clear-breakpoints'}:
+            pass
+        else:
+            raise ScriptError(f'Unknown command: {" ".join(words)}')
+
+    def _load(self, name):
+        path = self.dir/name
+        if path.suffix == '.asm':
+            with open(path, 'r') as f:
+                self.computer.load(assemble(remove_comments(f)))
+        elif path.suffix == '.hack':
+            self.computer.load(path)
+        elif path.suffix != '.hdl':
+            raise ScriptError(f'Cannot load {name}')
+
+    def _cycle(self):
+        "Execute one instruction, or restart the program if reset is set."
+        self.computer.run(1)
+        if self.reset: self.computer.reset()
+        self.half_cycle = False
+        self.time += 1
+
+    def _output(self, line):
+        if self.compare is not None:
+            n = len(self.lines)
+            if n >= len(self.compare) or not _match(self.compare[n], line):
+                self.lines.append(line)
+                expected = self.compare[n] if n < len(self.compare) else '<end of file>'
+                raise ComparisonFailure(f'{self.file.name}: comparison failure at line {n+1}:\n'
+                                        f'expected {expected}\n     got {line}')
+        self.lines.append(line)
+
+    def _address(self, name):
+        return int(name[name.index('[')+1:name.index(']')])
+
+    def get(self, name):
+        c = self.computer
+        register = name.split('[')[0]
+        if register == 'time': return f'{self.time}{"+" if self.half_cycle else ""}'
+        if register == 'reset': return self.reset
+        if register in {'A', 'ARegister'}: return c.a
+        if register in {'D', 'DRegister'}: return c.d
+        if register == 'PC': return c.pc
+        if register in {'RAM', 'RAM16K'}: return c.ram[self._address(name)]
+        if register == 'ROM32K': return c.rom[self._address(name)]
+        raise ScriptError(f'Unknown variable: {name}')
+
+    def set(self, name, value):
+        c = self.computer
+        register = name.split('[')[0]
+        if register == 'reset': self.reset = value
+        elif register in {'A', 'ARegister'}: c.a = value
+        elif register in {'D', 'DRegister'}: c.d = value
+        elif register == 'PC': c.pc = value
+        elif register in {'RAM', 'RAM16K'}: c.ram[self._address(name)] = value
+        else: raise ScriptError(f'Cannot set variable: {name}')
+
+def run_script(filename, write_output=True):
+    """Run a .tst script, raising `ComparisonFailure` if the output does
+    not match its compare-to file. Returns the output lines."""
+    return ScriptRunner(filename, write_output).run()
+
+if __name__=='__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run CPU emulator test scripts.')
+    parser.add_argument('filename', type=str, nargs='+',
+                        help='Test scripts to run.')
+    args = parser.parse_args()
+
+    failed = 0
+    for fn in args.filename:
+        try:
+            run_script(fn)
+            print(f'{fn}: End of script - Comparison ended successfully')
+        except (ComparisonFailure, ScriptError) as e:
+            print(e)
+            failed += 1
+    sys.exit(1 if failed else 0)
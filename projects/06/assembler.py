@@ -26,7 +26,16 @@ for line in lines:
     )
 """
 
-import re
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from itertools import permutations
+from pathlib import Path
+import hashlib
+import io
+import mmap
+import os
+import sys
+import time
 
 dests = {
     'M': 1,
@@ -55,9 +64,31 @@ computations = {
     'D+A':'000010', 'A+D':'000010', 'D+M':'000010',
     'M+D':'000010', 'D-M':'010011', 'D-A':'010011',
     'A-D':'000111', 'M-D':'000111', 'D&A':'000000',
-    'D&M':'000000', 'D|A':'010101', 'D|M':'010101'
+    'D&M':'000000', 'D|A':'010101', 'D|M':'010101',
+    'A&D':'000000', 'M&D':'000000', 'A|D':'010101',
+    'M|D':'010101'
 }
 
+def build_c_table():
+    """Precompute the opcode of every C-instruction from `dests`,
+    `computations` and `jumps`, keyed on its canonical text (dest=comp;JMP)."""
+    dest_codes = {'': 0}
+    for n in range(1, len(dests)+1):
+        for d in permutations(dests, n):
+            dest_codes[''.join(d)] = sum(dests[r] for r in d)
+
+    table = {}
+    for dest, d in dest_codes.items():
+        for comp, c in computations.items():
+            opcode = 0b111<<13 | int('M' in comp)<<12 | int(c, 2)<<6 | d<<3
+            text = dest+'='+comp if dest else comp
+            table[text] = opcode
+            for jump, j in jumps.items():
+                table[text+';'+jump.upper()] = opcode | j
+    return table
+
+c_instructions = build_c_table()
+
 VALID_CHARS = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_.$')
 
 class SymbolTable:
@@ -78,7 +109,7 @@ class SymbolTable:
     def __getitem__(self, k):
         if k not in self.symbols:
             self.push(k)
-        return to_bin(self.symbols[k])
+        return self.symbols[k]
 
     def __setitem__(self, k, v):
         assert set(k).issubset(VALID_CHARS)
@@ -93,9 +124,6 @@ class SymbolTable:
     def __repr__(self):
         return repr(self.symbols)
 
-def to_bin(value, pad=15):
-    return f"{{:0>{pad}}}".format(bin(value)[2:])
-
 def remove_comments(handle):
     block_comment=False
     for line in handle:
@@ -115,56 +143,243 @@ def remove_comments(handle):
             if len(line)>0:
                 yield line
 
-def assembler(filename, output=None):
-    assert filename[-4:] == '.asm', "File type should be '.asm'"
+def assemble(lines):
+    "Assemble cleaned asm lines into a list of 16-bit instruction words."
+    st = SymbolTable()
+    instructions = []
+    for line in lines:
+        if line[0] == '(' and line[-1] == ')':
+            symbol = line[1:-1]
+            assert set(symbol).issubset(VALID_CHARS)
+            st[symbol] = len(instructions)
+        else:
+            instructions.append(line)
 
+    encode_c = c_instructions.get
+    words = []
+    for line in instructions:
+        if line[0] == '@':
+            words.append(parse_a_instruction(line, st))
+        else:
+            word = encode_c(line)
+            words.append(parse_c_instruction(line) if word is None else word)
+    return words
+
+def backpatch(words, last, value):
+    "Set every word of the reference chain ending at index `last` to `value`."
+    while last >= 0:
+        previous = words[last] - 1
+        words[last] = value
+        last = previous
+
+def assemble_stream(lines):
+    """Assemble cleaned asm lines in a single pass. The references to a
+    symbol not yet defined are chained through the word buffer, each
+    holding the index+1 of the previous one (0 ends the chain), and
+    backpatched when its label is defined. Memory is one word per
+    instruction and one entry per pending symbol. The symbols left at the
+    end are variables, allocated in order of first use."""
     st = SymbolTable()
-    cleaned_lines = []
-    symbol_count = 0
-    with open(filename, 'r') as f:
-        for i,line in enumerate(remove_comments(f)):
-            if line[0] == '(' and line[-1] == ')':
-                symbol = line[1:-1]
-                assert set(symbol).issubset(VALID_CHARS)
-                st[symbol] = i - symbol_count
-                symbol_count += 1
-            else:
-                cleaned_lines.append(line)
+    symbols = st.symbols
+    words = array('H')
+    pending = {}    # Symbol -> index of its last reference
 
-    out = filename[:-4]+".hack" if output is None else output
-    with open(out, 'w') as f:
-        for line in cleaned_lines:
-            if line[0] == '@':
-                print(parse_a_instruction(line, st), file=f)
+    encode_c = c_instructions.get
+    for line in lines:
+        if line[0] == '@':
+            v = line[1:]
+            if v in symbols:
+                words.append(symbols[v])
+            elif v.isdecimal():
+                words.append(parse_a_instruction(line, st))
             else:
-                print(parse_c_instruction(line), file=f)
+                words.append(pending.get(v, -1) + 1)
+                pending[v] = len(words) - 1
+        elif line[0] == '(' and line[-1] == ')':
+            symbol = line[1:-1]
+            assert set(symbol).issubset(VALID_CHARS)
+            st[symbol] = len(words)
+            if symbol in pending:
+                backpatch(words, pending.pop(symbol), symbols[symbol])
+        else:
+            word = encode_c(line)
+            words.append(parse_c_instruction(line) if word is None else word)
+
+    for v, last in pending.items():
+        backpatch(words, last, st[v])
+    return words
+
+def write_hack(words, handle):
+    "Write the instruction words as '0'/'1' text lines."
+    handle.write(''.join(map('{:016b}\n'.format, words)))
+
+def read_hack(filename):
+    "Read the instruction words of a textual .hack file."
+    with open(filename, 'r') as f:
+        return array('H', [int(line, 2) for line in f if line.strip()])
+
+def write_binary(words, handle, byteorder='little'):
+    "Write the instruction words as a packed uint16 image in one write."
+    image = array('H', words)
+    if byteorder != sys.byteorder: image.byteswap()
+    handle.write(image.tobytes())
+
+def read_binary(filename, byteorder='little'):
+    "Read a packed uint16 image written by `write_binary`."
+    image = array('H')
+    with open(filename, 'rb') as f:
+        if f.seek(0, 2) > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                image.frombytes(m)
+    if byteorder != sys.byteorder: image.byteswap()
+    return image
+
+# Output format: (extension, file mode, writer)
+output_formats = {
+    'hack': ('.hack', 'w', write_hack),
+    'little': ('.bin', 'wb', lambda w,f: write_binary(w, f, 'little')),
+    'big': ('.bin', 'wb', lambda w,f: write_binary(w, f, 'big')),
+}
+
+class AssemblyCache:
+    """On disk cache of assembled images, keyed on a hash of the source
+    and the encoding tables. Entries are evicted least recently used
+    first once the cache grows beyond `max_bytes`."""
+    def __init__(self, path=None, max_bytes=64*2**20):
+        self.path = Path(path or os.environ.get('HACK_ASM_CACHE',
+                         Path.home()/'.cache'/'hack-assembler'))
+        self.max_bytes = max_bytes
+        tables = repr((sorted(c_instructions.items()), sorted(SymbolTable().symbols.items())))
+        self.fingerprint = hashlib.sha256(tables.encode()).digest()
+
+    def key(self, source):
+        return hashlib.sha256(self.fingerprint + source).hexdigest()
+
+    def get(self, key):
+        "Return the cached words for `key`, or None on a miss."
+        entry = self.path/key
+        try:
+            words = read_binary(entry)
+            os.utime(entry)
+        except FileNotFoundError:
+            return None
+        return words
+
+    def put(self, key, words):
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp = self.path/f'.{key}.{os.getpid()}'
+        with open(tmp, 'wb') as f:
+            write_binary(words, f)
+        os.replace(tmp, self.path/key)
+        self.evict()
+
+    def evict(self):
+        "Remove the least recently used entries until under `max_bytes`."
+        entries = []
+        for e in self.path.iterdir():
+            if e.name.startswith('.'): continue
+            try:
+                entries.append((e.stat(), e))
+            except FileNotFoundError:
+                pass    # Evicted by another process
+        size = sum(st.st_size for st,_ in entries)
+        for st, entry in sorted(entries, key=lambda e: e[0].st_mtime):
+            if size <= self.max_bytes: break
+            entry.unlink(missing_ok=True)
+            size -= st.st_size
+
+    def clear(self):
+        if self.path.is_dir():
+            for entry in self.path.iterdir():
+                entry.unlink(missing_ok=True)
+
+def assembler(filename, output=None, fmt='hack', stream=False, cache=None):
+    """Assemble `filename` into `output`.
+
+    Parameters:
+        filename (str): the .asm file to assemble.
+        output (str): the output filename. Defaults to the input
+            filename with the format's extension.
+        fmt (str): 'hack' for text output, or 'little'/'big' for a
+            packed uint16 binary image of that byte order.
+        stream (bool): assemble in a single pass, backpatching forward
+            references, instead of collecting the lines first.
+        cache (AssemblyCache): reuse the image of an unchanged source.
+    """
+    assert filename[-4:] == '.asm', "File type should be '.asm'"
+    ext, mode, writer = output_formats[fmt]
+    assemble_lines = assemble_stream if stream else assemble
+
+    miss = False
+    if cache is None:
+        with open(filename, 'r') as f:
+            words = assemble_lines(remove_comments(f))
+    else:
+        with open(filename, 'rb') as f:
+            source = f.read()
+        key = cache.key(source)
+        words = cache.get(key)
+        if words is None:
+            miss = True
+            words = assemble_lines(remove_comments(io.TextIOWrapper(io.BytesIO(source))))
+
+    out = filename[:-4]+ext if output is None else output
+    with open(out, mode) as f:
+        writer(words, f)
+    # Only cache the image once the output was written
+    if miss:
+        cache.put(key, words)
+
+def _timed_assembler(filename, output, **kwargs):
+    "Assemble one file, returning the time taken and any error raised."
+    start = time.perf_counter()
+    try:
+        assembler(filename, output, **kwargs)
+        error = None
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+    return time.perf_counter() - start, error
+
+def assemble_files(filenames, outputs=None, jobs=1, **kwargs):
+    """Assemble independent files across `jobs` worker processes.
+    A failing file does not stop the others.
+
+    Returns:
+        list of (filename, seconds, error) tuples in input order, where
+        error is None if the file assembled successfully.
+    """
+    if outputs is None: outputs = [None]*len(filenames)
+    if jobs == 1:
+        results = [_timed_assembler(fn, fo, **kwargs) for fn, fo in zip(filenames, outputs)]
+    else:
+        with ProcessPoolExecutor(jobs or None) as pool:
+            futures = [pool.submit(_timed_assembler, fn, fo, **kwargs)
+                       for fn, fo in zip(filenames, outputs)]
+            results = [f.result() for f in futures]
+    return [(fn, t, err) for fn, (t, err) in zip(filenames, results)]
 
 def parse_a_instruction(line, st):
     v = line[1:]
     if v.isdecimal():
         v = int(v)
         assert v < 2**15
-        return '0' + to_bin(v)
+        return v
     else:
-        return '0'+"{:0>15}".format(st[v])
+        return st[v]
 
 def parse_c_instruction(line):
+    "Encode a C-instruction, accepting jumps in any letter case."
+    try:
+        return c_instructions[line]
+    except KeyError:
+        pass
     _j = line.find(';')
-    j = to_bin(jumps[line[_j+1:].lower()], pad=3) if _j > 0 else '000'
-    line = line if _j==-1 else line[:_j]
-
-    split = line.split('=')
-    if len(split)>1:
-        dest, comp = split
-        d = to_bin(sum(dests[a] for a in dest), 3)
-    else:
-        comp = split[0]
-        d = '000'
-
-    a = str(int('M' in comp))
-    c = parse_computation(comp)
+    if _j > 0 and line[_j+1:].upper() != line[_j+1:]:
+        return parse_c_instruction(line[:_j+1] + line[_j+1:].upper())
 
-    return "111" + a + c + d + j
+    comp = line if _j == -1 else line[:_j]
+    parse_computation(comp[comp.find('=')+1:])
+    raise ValueError(f'Instruction not recognized: {line}')
 
 def parse_computation(comp):
     try:
@@ -180,10 +395,44 @@ if __name__=='__main__':
                         help='Filenames to process.')
     parser.add_argument('--outputs', '-o', type=str, nargs='+',
                         help='Filenames of the outputs.')
+    parser.add_argument('--format', '-f', type=str, default='hack',
+                        choices=list(output_formats),
+                        help='Output format: .hack text or a little/big endian binary image.')
+
+    parser.add_argument('--stream', action='store_true',
+                        help='Assemble in a single pass with backpatching.')
+
+    parser.add_argument('--jobs', '-j', type=int,
+                        help='Assemble files in N processes (0 for one per core), '
+                             'reporting the time and result of each file.')
+
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Always assemble, bypassing the image cache.')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='Remove all cached images before assembling.')
+    parser.add_argument('--cache-dir', type=str,
+                        help='Cache directory (default ~/.cache/hack-assembler).')
+    parser.add_argument('--cache-size', type=int, default=64,
+                        help='Maximum cache size in MB.')
 
     args = parser.parse_args()
     if args.outputs is None: args.outputs = [None]*len(args.filename)
     assert len(args.filename) == len(args.outputs)
 
-    for fn, fo in zip(args.filename, args.outputs):
-        assembler(fn, fo)
+    cache = AssemblyCache(args.cache_dir, args.cache_size*2**20)
+    if args.clear_cache: cache.clear()
+    if args.no_cache: cache = None
+
+    if args.jobs is None:
+        for fn, fo in zip(args.filename, args.outputs):
+            assembler(fn, fo, fmt=args.format, stream=args.stream, cache=cache)
+    else:
+        start = time.perf_counter()
+        results = assemble_files(args.filename, args.outputs, args.jobs,
+                                 fmt=args.format, stream=args.stream, cache=cache)
+        for fn, t, err in results:
+            print(f'{fn}: {t*1000:.1f}ms' + ('' if err is None else ' FAILED '+err))
+        failed = sum(err is not None for _,_,err in results)
+        print(f'Assembled {len(results)-failed}/{len(results)} files '
+              f'in {time.perf_counter()-start:.2f}s')
+        if failed: sys.exit(1)
@@ -0,0 +1,88 @@
+"""Measure assembler throughput in lines/sec, against the string based
+encoder the table-driven one replaced."""
+
+import time
+
+from assembler import (SymbolTable, VALID_CHARS, assemble, assemble_stream,
+    computations, dests, jumps, remove_comments, write_hack)
+
+class _Null:
+    def write(self, s): pass
+
+def to_bin(value, pad=15):
+    return f"{{:0>{pad}}}".format(bin(value)[2:])
+
+def baseline_c_instruction(line):
+    _j = line.find(';')
+    j = to_bin(jumps[line[_j+1:].lower()], pad=3) if _j > 0 else '000'
+    line = line if _j==-1 else line[:_j]
+
+    split = line.split('=')
+    if len(split)>1:
+        dest, comp = split
+        d = to_bin(sum(dests[a] for a in dest), 3)
+    else:
+        comp = split[0]
+        d = '000'
+
+    a = str(int('M' in comp))
+    return "111" + a + computations[comp] + d + j
+
+def baseline(lines, handle):
+    "The original assembler: bit strings built per field, printed per line."
+    st = SymbolTable()
+    cleaned_lines = []
+    symbol_count = 0
+    for i,line in enumerate(lines):
+        if line[0] == '(' and line[-1] == ')':
+            symbol = line[1:-1]
+            assert set(symbol).issubset(VALID_CHARS)
+            st[symbol] = i - symbol_count
+            symbol_count += 1
+        else:
+            cleaned_lines.append(line)
+
+    for line in cleaned_lines:
+        if line[0] == '@':
+            v = line[1:]
+            if v.isdecimal():
+                v = int(v)
+                assert v < 2**15
+                print('0' + to_bin(v), file=handle)
+            else:
+                print('0' + to_bin(st[v]), file=handle)
+        else:
+            print(baseline_c_instruction(line), file=handle)
+
+def bench(filename, repeat=10, stream=False, legacy=False):
+    with open(filename, 'r') as f:
+        lines = list(remove_comments(f))
+
+    assemble_lines = assemble_stream if stream else assemble
+    start = time.perf_counter()
+    for _ in range(repeat):
+        if legacy:
+            baseline(lines, _Null())
+        else:
+            write_hack(assemble_lines(lines), _Null())
+    elapsed = (time.perf_counter() - start) / repeat
+    return len(lines), elapsed
+
+if __name__=='__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Hack assembler benchmark.')
+    parser.add_argument('filename', type=str, nargs='*', default=['pong/Pong.asm'],
+                        help='Filenames to assemble.')
+    parser.add_argument('--repeat', '-r', type=int, default=10,
+                        help='Number of timed runs per file.')
+    parser.add_argument('--stream', action='store_true',
+                        help='Benchmark the single pass assembler.')
+
+    args = parser.parse_args()
+    for fn in args.filename:
+        n, t0 = bench(fn, args.repeat, legacy=True)
+        n, t = bench(fn, args.repeat, args.stream)
+        print(f'{fn}: {n} lines')
+        print(f'  baseline: {t0*1000:.1f}ms ({n/t0:,.0f} lines/sec)')
+        print(f'  table:    {t*1000:.1f}ms ({n/t:,.0f} lines/sec), {t0/t:.1f}x')
@@ -1,3 +1,7 @@
+import io
+import os
+import tempfile
+
 from assembler import *
 
 def test_parse_computation_match():
@@ -40,12 +44,106 @@ def test_parse_computation_match():
     assert parse_computation('D|A')=='010101'
     assert parse_computation('D|M')=='010101'
 
+def test_parse_c_instruction():
+    assert parse_c_instruction('D=M') == 0b1111110000010000
+    assert parse_c_instruction('AM=M-1') == 0b1111110010101000
+    assert parse_c_instruction('MA=M-1') == parse_c_instruction('AM=M-1')
+    assert parse_c_instruction('0;JMP') == 0b1110101010000111
+    assert parse_c_instruction('D;jgt') == parse_c_instruction('D;JGT')
+    try:
+        parse_c_instruction('D=X')
+        assert False, 'Invalid computation should raise'
+    except ValueError:
+        pass
+
 def test_assembler():
     for file in ['add', 'max', 'rect', 'pong']:
         name = f"{file}/{file.capitalize()}"
         assembler(f"{name}.asm")
         assert open(f"{name}.hack").read() == open(f"{file}/{file}_ans.hack").read()
 
+def test_bench_baseline():
+    from bench_assembler import baseline
+    for file in ['add', 'max', 'rect', 'pong']:
+        with open(f"{file}/{file.capitalize()}.asm") as f:
+            lines = list(remove_comments(f))
+        out = io.StringIO()
+        baseline(lines, out)
+        assert out.getvalue() == open(f"{file}/{file}_ans.hack").read()
+
+def test_assembler_stream():
+    for file in ['add', 'max', 'rect', 'pong']:
+        name = f"{file}/{file.capitalize()}"
+        assembler(f"{name}.asm", stream=True)
+        assert open(f"{name}.hack").read() == open(f"{file}/{file}_ans.hack").read()
+
+        with open(f"{name}.asm") as f:
+            lines = list(remove_comments(f))
+        assert list(assemble_stream(lines)) == assemble(lines)
+
+    # Forward references and variables, each used many times, interleaved
+    lines = []
+    for i in range(200):
+        lines += [f'@L{i % 7}', 'D=A', f'@v{i % 5}', 'M=D', f'@v{i % 3}', 'M=M+1']
+        if i % 40 == 39: lines.append(f'(L{i // 40})')
+    lines += ['(L5)', '@L6', '0;JMP', '(L6)']
+    assert list(assemble_stream(lines)) == assemble(lines)
+
+def test_assemble_files():
+    files = [f"{f}/{f.capitalize()}.asm" for f in ['add', 'max', 'rect', 'pong']]
+    results = assemble_files(files + ['add/add_ans.hack'], jobs=2)
+    assert [r[0] for r in results] == files + ['add/add_ans.hack']
+    assert all(err is None for _,_,err in results[:-1])
+    assert results[-1][2].startswith('AssertionError')
+    for f in files:
+        ans = f.split('/')[0]
+        assert open(f[:-4]+'.hack').read() == open(f"{ans}/{ans}_ans.hack").read()
+
+def test_assembly_cache():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = AssemblyCache(os.path.join(tmp, 'cache'), max_bytes=32)
+        assembler("add/Add.asm", os.path.join(tmp, 'Add.hack'), cache=cache)
+        key = cache.key(open("add/Add.asm", 'rb').read())
+        assert list(cache.get(key)) == list(read_hack("add/add_ans.hack"))
+
+        # Hits are served from the cache
+        cache.put(key, [1, 2, 3])
+        assembler("add/Add.asm", os.path.join(tmp, 'Add_cached.hack'), cache=cache)
+        assert list(read_hack(os.path.join(tmp, 'Add_cached.hack'))) == [1, 2, 3]
+
+        # Adding a larger image evicts the least recently used entry
+        os.utime(cache.path/key, (0, 0))
+        assembler("max/Max.asm", os.path.join(tmp, 'Max.hack'), cache=cache)
+        assert cache.get(key) is None
+
+        # Entries removed by another process while evicting are skipped
+        (cache.path/'gone').symlink_to(cache.path/'missing')
+        cache.evict()
+        cache.clear()
+        assert list(cache.path.iterdir()) == []
+
+        # Nothing is cached when the output cannot be written
+        try:
+            assembler("add/Add.asm", os.path.join(tmp, 'missing', 'Add.hack'), cache=cache)
+            assert False, 'Expected an error'
+        except FileNotFoundError:
+            pass
+        assert list(cache.path.iterdir()) == []
+
+def test_binary_formats():
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in ['little', 'big']:
+            name = os.path.join(tmp, f'Pong_{fmt}.bin')
+            assembler("pong/Pong.asm", name, fmt=fmt)
+            assert read_binary(name, fmt) == read_hack("pong/pong_ans.hack")
+            assert len(open(name, 'rb').read()) == 2*len(read_binary(name, fmt))
+
 if __name__=='__main__':
     test_parse_computation_match()
+    test_parse_c_instruction()
     test_assembler()
+    test_bench_baseline()
+    test_assembler_stream()
+    test_assemble_files()
+    test_assembly_cache()
+    test_binary_formats()
@@ -0,0 +1,62 @@
+"""Report the ROM size of programs under the translator's code size options.
+
+    python code_size.py FunctionCalls/FibonacciElement FunctionCalls/StaticsTest
+    python code_size.py ../11/Pong --lib ../12
+
+Each program is a directory (or file) of .vm or .jack files; the Jack
+classes are compiled in memory with the projects/11 compiler.
+"""
+
+from pathlib import Path
+import sys
+
+import peephole
+from translator import translate_program
+
+sys.path.append(str(Path(__file__).resolve().parent.parent/'11'))
+from pipeline import Pipeline
+
+MODES = {
+    'default': {},
+    'shared compares': {'shared_compares': True},
+    'shared calls': {'shared_calls': True},
+    'shared calls+compares': {'shared_calls': True, 'shared_compares': True},
+    'optimized': {'optimize': True},
+    'optimized+shared': {'optimize': True, 'shared_calls': True, 'shared_compares': True},
+    'stack cache': {'stack_cache': True},
+    'optimized+stack cache': {'optimize': True, 'stack_cache': True},
+    'optimized+shared+stack cache': {'optimize': True, 'shared_calls': True,
+                                     'shared_compares': True, 'stack_cache': True},
+    'linked': {'link_functions': True},
+    'all': {'optimize': True, 'shared_calls': True, 'shared_compares': True,
+            'stack_cache': True, 'link_functions': True},
+}
+
+def code_size(program, **options):
+    "The number of instructions of a translated program."
+    asm = '\n'.join(translate_program(program, verbose=False, **options))
+    return peephole.count_instructions(peephole.parse_asm(asm))
+
+def report(paths, lib=(), modes=MODES):
+    "Print the size of each program in each mode, relative to the default."
+    width = max(map(len, modes))
+    for path in paths:
+        program = Pipeline().compile([path, *lib])
+        print(f'{path} ({len(program)} files)')
+        base = None
+        for mode, options in modes.items():
+            size = code_size(program, **options)
+            base = base or size
+            print(f'  {mode:<{width}} {size:>6} ({(size-base)/base:+.1%})')
+
+if __name__=='__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Report the code size of VM programs.')
+    parser.add_argument('path', type=str, nargs='+',
+                        help='.vm/.jack files or directories, one per program.')
+    parser.add_argument('--lib', '-l', type=str, nargs='+', default=[],
+                        help='Directories linked into every program, e.g. the OS.')
+
+    args = parser.parse_args()
+    report(args.path, args.lib)
@@ -0,0 +1,108 @@
+"""
+Peephole optimization of generated hack assembly.
+
+The translator's templates are written for one VM command at a time,
+so a value pushed by one command is often popped straight back off by
+the next. The optimizer works on a list of instructions (annotation
+comments are kept as entries starting with '//') and rewrites the tail
+of the output after every instruction, so rewrites cascade:
+
+    @SP          @SP          @SP
+    A=M          A=M          A=M
+    M=D          M=D          M=D          @8
+    @SP          @SP          @8     ->    D=A
+    M=M+1   ->   A=M     ->   D=A          ...
+    @SP          D=M          ...
+    AM=M-1       @8
+    D=M          D=A
+    @8           ...
+    D=A
+    ...
+
+Labels never match a rule, so nothing is moved across a jump target.
+The rules rely on the VM stack invariant: RAM[SP] and above are free,
+so a value stored at RAM[SP] without incrementing SP is dead.
+"""
+
+def is_a_instruction(ins):
+    return ins[0] == '@'
+
+def not_sp(ins):
+    return ins[0] == '@' and ins != '@SP'
+
+def sp_decrement(ins):
+    "Instructions after @SP that only read below the top of the stack."
+    return ins in {'A=M-1', 'AM=M-1', 'M=M-1'}
+
+# (pattern, replacement): patterns match the last code instructions of the
+# output. Pattern entries are instructions or predicates; replacements are
+# instructions or the index of a matched instruction to keep.
+rules = [
+    # push then pop: the SP increment and decrement cancel out
+    (('@SP', 'M=M+1', '@SP', 'M=M-1'), ('@SP',)),
+    (('@SP', 'M=M+1', '@SP', 'AM=M-1'), ('@SP', 'A=M')),
+    # reloading the stack pointer that was just used
+    (('@SP', 'A=M', 'M=D', '@SP', 'A=M'), ('@SP', 'A=M', 'M=D')),
+    # reading back the value just written
+    (('M=D', 'D=M'), ('M=D',)),
+    # dead store above the top of the stack
+    (('@SP', 'A=M', 'M=D', not_sp), (3,)),
+    (('@SP', 'A=M', 'M=D', '@SP', sp_decrement), ('@SP', 4)),
+    # push then a unary operation on the top of the stack
+    (('@SP', 'A=M', 'M=D', '@SP', 'M=M+1', '@SP', 'A=M-1'), ('@SP', 'AM=M+1', 'A=A-1', 'M=D')),
+]
+
+# Applied after `rules`, to the pushes that were not optimized away
+final_rules = [
+    (('@SP', 'A=M', 'M=D', '@SP', 'M=M+1'), ('@SP', 'AM=M+1', 'A=A-1', 'M=D')),
+]
+
+def parse_asm(asm):
+    "Split asm text into instructions, dropping whitespace and inline comments."
+    instructions = []
+    for line in asm.split('\n'):
+        line = line.strip()
+        if not line.startswith('//'):
+            line = line.split('//')[0].strip()
+        if line:
+            instructions.append(line)
+    return instructions
+
+def count_instructions(instructions):
+    "Count the instructions that occupy ROM (not labels or comments)."
+    return sum(1 for ins in instructions if ins[0] != '(' and not ins.startswith('//'))
+
+def _matches(pattern, window):
+    return all(p(w) if callable(p) else p == w for p, w in zip(pattern, window))
+
+def optimize(instructions):
+    "Apply the peephole `rules` then `final_rules` to a list of instructions."
+    return rewrite(rewrite(instructions, rules), final_rules)
+
+def rewrite(instructions, rules):
+    "Rewrite the tail of the output with `rules` after each instruction."
+    out = []
+    code = []   # indices in `out` of the code (non comment) instructions
+    for ins in instructions:
+        out.append(ins)
+        if ins.startswith('//'): continue
+        code.append(len(out)-1)
+
+        changed = True
+        while changed:
+            changed = False
+            for pattern, replacement in rules:
+                n = len(pattern)
+                if len(code) < n: continue
+                window = [out[i] for i in code[-n:]]
+                if not _matches(pattern, window): continue
+
+                start = code[-n]
+                comments = [c for c in out[start:] if c.startswith('//')]
+                new = [window[r] if isinstance(r, int) else r for r in replacement]
+                out[start:] = comments + new
+                del code[-n:]
+                code.extend(range(len(out)-len(new), len(out)))
+                changed = True
+                break
+    return out
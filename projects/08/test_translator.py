@@ -1,26 +1,340 @@
 from pathlib import Path
-from translator import translator
+import io
+import sys
+import tempfile
 
+from peephole import count_instructions, optimize, parse_asm
+from translator import link, translate_commands, translator
+from vm_interpreter import IF_GOTO, VMError, VMInterpreter, VMProgram, vm_files
 
-def test_program_flow():
+sys.path.append(str(Path(__file__).resolve().parent.parent/'05'))
+from tst_runner import run_script
+from emulator import Computer
+sys.path.append(str(Path(__file__).resolve().parent.parent/'06'))
+from assembler import assemble, remove_comments
+sys.path.append(str(Path(__file__).resolve().parent.parent/'11'))
+from compilation_engine import CompilationEngine
+
+
+def test_stack_and_memory(optimize=False, shared_compares=False, stack_cache=False):
+    for p in ['StackArithmetic/SimpleAdd/SimpleAdd',
+              'StackArithmetic/StackTest/StackTest',
+              'MemoryAccess/BasicTest/BasicTest',
+              'MemoryAccess/PointerTest/PointerTest',
+              'MemoryAccess/StaticTest/StaticTest']:
+        p = '../07/'+p
+        with open(p+'.asm', 'w') as fout:
+            translator([p+'.vm'], fout, annotate=True, bootstrap=False, optimize=optimize,
+                       shared_compares=shared_compares, stack_cache=stack_cache)
+        run_script(p+'.tst', write_output=False)
+
+
+def test_program_flow(optimize=False, stack_cache=False):
     for p in ['ProgramFlow/BasicLoop/BasicLoop',
               'ProgramFlow/FibonacciSeries/FibonacciSeries']:
         with open(p+'.asm', 'w') as fout:
-            translator([p+'.vm'], fout, annotate=True)
+            translator([p+'.vm'], fout, annotate=True, bootstrap=False, optimize=optimize,
+                       stack_cache=stack_cache)
+        run_script(p+'.tst', write_output=False)
 
 
-def test_function_calls():
-    for p in [
-        './FunctionCalls/SimpleFunction',
-        './FunctionCalls/NestedCall',
-        './FunctionCalls/FibonacciElement',
-        './FunctionCalls/StaticsTest'
+def test_function_calls(optimize=False, shared_calls=False, shared_compares=False,
+                        stack_cache=False):
+    for p, bootstrap in [
+        ('./FunctionCalls/SimpleFunction', False),
+        ('./FunctionCalls/NestedCall', True),
+        ('./FunctionCalls/FibonacciElement', True),
+        ('./FunctionCalls/StaticsTest', True),
     ]:
         p = Path(p)
         files = [fin for fin in p.iterdir() if fin.suffix == '.vm']
         with open(str(p/p.stem)+'.asm', 'w') as fout:
-            translator(files, fout, annotate=True)
+            translator(files, fout, annotate=True, bootstrap=bootstrap, optimize=optimize,
+                       shared_calls=shared_calls, shared_compares=shared_compares,
+                       stack_cache=stack_cache)
+        run_script(str(p/p.stem)+'.tst', write_output=False)
+
+def test_optimized():
+    test_stack_and_memory(optimize=True)
+    test_program_flow(optimize=True)
+    test_function_calls(optimize=True)
+
+
+def test_shared_calls():
+    test_function_calls(shared_calls=True)
+    test_function_calls(optimize=True, shared_calls=True)
+
+
+def test_shared_compares():
+    test_stack_and_memory(shared_compares=True)
+    test_stack_and_memory(optimize=True, shared_compares=True)
+    test_function_calls(optimize=True, shared_calls=True, shared_compares=True)
+
+
+def test_stack_cache():
+    for optimize in (False, True):
+        test_stack_and_memory(optimize, stack_cache=True)
+        test_program_flow(optimize, stack_cache=True)
+        test_function_calls(optimize, stack_cache=True)
+    test_function_calls(shared_calls=True, shared_compares=True, stack_cache=True)
+    test_fused_branches(stack_cache=True)
+    test_unique_labels(stack_cache=True)
+
+
+def test_stack_cache_far_pop():
+    "Pops to far offsets of the pointer segments, with and without D cached."
+    lines = ['function Sys.init 0', 'push constant 3000', 'pop pointer 1',
+             'push constant 3100', 'pop pointer 0', 'push constant 2', 'call Sys.f 1',
+             'pop that 9', 'push constant 7', 'pop this 12', 'push constant 5',
+             'push constant 6', 'add', 'pop that 4', 'label END', 'goto END',
+             'function Sys.f 6', 'push argument 0', 'pop local 5', 'call Sys.g 0',
+             'pop local 4', 'push local 5', 'push local 4', 'add', 'return',
+             'function Sys.g 0', 'push constant 40', 'return']
+    with tempfile.TemporaryDirectory() as tmp:
+        f = Path(tmp)/'Sys.vm'
+        f.write_text('\n'.join(lines) + '\n')
+        vm = VMInterpreter(VMProgram([f]))
+        for stack_cache in (False, True):
+            out = io.StringIO()
+            translator([f], out, optimize=True, stack_cache=stack_cache)
+            computer = Computer(assemble(remove_comments(io.StringIO(out.getvalue()))))
+            computer.run(10**4)
+            assert computer.ram[3000:3013] == [0]*4 + [11] + [0]*4 + [42] + [0]*3
+            assert computer.ram[3112] == 7
+    vm.bootstrap()
+    vm.run()
+    assert vm.ram[3009] == 42
+
+    # Caching the top of the stack never makes these pops longer
+    for commands in [['pop local 5'], ['pop argument 7', 'pop that 9'],
+                     ['push argument 0', 'pop local 5'], ['push constant 7', 'pop this 12'],
+                     ['push constant 5', 'push constant 6', 'add', 'pop that 4']]:
+        commands = [tuple(c.split()) for c in commands]
+        for optimize in (False, True):
+            size = lambda stack_cache: count_instructions(parse_asm('\n'.join(translate_commands(
+                'Sys.vm', commands, optimize=optimize, stack_cache=stack_cache)[0])))
+            assert size(True) <= size(False), (commands, optimize)
+
+
+def test_peephole():
+    push_add = parse_asm("""@SP\nA=M\nM=D\n@SP\nM=M+1
+        @SP\nM=M-1\nA=M\nD=M\n@SP\nA=M-1\nM=M+D""")
+    assert optimize(push_add) == ['@SP', 'A=M-1', 'M=M+D']
+    # Nothing is removed across a label
+    labelled = parse_asm("@SP\nA=M\nM=D\n(LOOP)\n@SP\nM=M+1")
+    assert optimize(labelled) == labelled
+
+
+def test_vm_interpreter():
+    for p, expected in [
+        ('FunctionCalls/NestedCall', {0: 261, 1: 261, 2: 256, 3: 4000, 4: 5000, 5: 135, 6: 246}),
+        ('FunctionCalls/FibonacciElement', {0: 262, 261: 3}),
+        ('FunctionCalls/StaticsTest', {0: 263, 261: 65534, 262: 8}),
+    ]:
+        vm = VMInterpreter(VMProgram(vm_files([p])))
+        vm.bootstrap()
+        vm.run()
+        assert vm.halted
+        assert {i: vm.ram[i] for i in expected} == expected
+
+    vm = VMInterpreter(VMProgram(vm_files(['ProgramFlow/FibonacciSeries'])))
+    vm.ram[:4] = [256, 300, 400, 3000]
+    vm.ram[400:402] = [6, 3000]
+    vm.run()
+    assert vm.ram[3000:3006] == [0, 1, 1, 2, 3, 5]
+
+    # Bootstrapping again restarts the program without growing its code
+    vm = VMInterpreter(VMProgram(vm_files(['FunctionCalls/FibonacciElement'])))
+    size = len(vm.program.code)
+    for _ in range(2):
+        vm.bootstrap()
+        vm.run()
+        assert vm.halted and vm.ram[0] == 262 and vm.ram[261] == 3
+    assert len(vm.program.code) == size
+
+    # Labels before the first function of a file are not scoped to the last file's function
+    with tempfile.TemporaryDirectory() as tmp:
+        a, b = Path(tmp)/'A.vm', Path(tmp)/'B.vm'
+        a.write_text('function A.f 0\nlabel L\npush constant 0\nif-goto L\nreturn\n')
+        b.write_text('label L\npush constant 0\nif-goto L\n')
+        program = VMProgram([a, b])
+    assert [x for op, x, _ in program.code if op == IF_GOTO] == [1, 4]
+
+    # Running a few commands at a time ends in the same state after as many commands
+    full = VMInterpreter(VMProgram(vm_files(['FunctionCalls/FibonacciElement'])))
+    full.bootstrap()
+    sliced = VMInterpreter(VMProgram(vm_files(['FunctionCalls/FibonacciElement'])))
+    sliced.bootstrap()
+    assert [sliced.run(7) for _ in range(full.run() // 7)] == [7] * (full.steps // 7)
+    sliced.run()
+    assert sliced.halted and sliced.steps == full.steps
+    # Only the free stack above SP, where blocks skip the values they consume, may differ
+    sp = full.ram[0]
+    assert sliced.ram[:sp] == full.ram[:sp] and sliced.ram[2048:] == full.ram[2048:]
+
+    # Addresses below 0 are errors rather than wrapping around to the end of RAM
+    with tempfile.TemporaryDirectory() as tmp:
+        f = Path(tmp)/'Sys.vm'
+        f.write_text('function Sys.init 0\npush constant 1\nreturn\n')
+        vm = VMInterpreter(VMProgram([f]))
+    vm.ram[0] = 256
+    try:
+        vm.run()
+        assert False, 'Expected an error'
+    except VMError as e:
+        assert 'out of range in Sys.init' in str(e)
+
+
+def test_vm_interpreter_jack():
+    "Compile 11/ConvertToBin with the OS and run it on the interpreter."
+    with tempfile.TemporaryDirectory() as tmp:
+        for f in [*Path('../12').glob('*.jack'), Path('../11/ConvertToBin/Main.jack')]:
+            c = CompilationEngine(f, Path(tmp)/(f.stem+'.vm'))
+            c.compile()
+            c.writer.close()
+        vm = VMInterpreter(VMProgram(vm_files([tmp])))
+    vm.ram[8000] = 0b1100101
+    vm.bootstrap()
+    vm.run(10**6)
+    assert vm.halted
+    assert vm.ram[8001:8017] == [1, 0, 1, 0, 0, 1, 1] + [0]*9
+
+
+def test_unique_labels(stack_cache=False, link_functions=False):
+    """Compile ConvertToBin with the OS, whose classes reuse the same label
+    names, translate it in parallel and run it on the emulator."""
+    with tempfile.TemporaryDirectory() as tmp:
+        for f in [*Path('../12').glob('*.jack'), Path('../11/ConvertToBin/Main.jack')]:
+            c = CompilationEngine(f, Path(tmp)/(f.stem+'.vm'))
+            c.compile()
+            c.writer.close()
+        files = vm_files([tmp])
+        outputs = []
+        for jobs in (1, 2):
+            out = io.StringIO()
+            translator(files, out, shared_calls=True, jobs=jobs, stack_cache=stack_cache,
+                       link_functions=link_functions)
+            outputs.append(out.getvalue())
+    assert outputs[0] == outputs[1]
+
+    lines = list(remove_comments(io.StringIO(outputs[0])))
+    labels = [line for line in lines if line[0] == '(']
+    assert len(labels) == len(set(labels))
+    computer = Computer(assemble(lines))
+    computer.ram[8000] = 0b1100101
+    computer.run(3*10**6)   # Sys.halt loops forever
+    assert computer.ram[8001:8017] == [1, 0, 1, 0, 0, 1, 1] + [0]*9
+
+
+def test_link():
+    program = [('Sys.vm', [('function', 'Sys.init', '0'), ('call', 'Main.main', '0'),
+                           ('label', 'END'), ('goto', 'END')]),
+               ('Main.vm', [('function', 'Main.main', '0'), ('call', 'Main.f', '0'), ('return',),
+                            ('function', 'Main.unused', '0'), ('call', 'Lib.g', '0'), ('return',),
+                            ('function', 'Main.f', '0'), ('call', 'Main.f', '0'), ('return',)]),
+               ('Lib.vm', [('function', 'Lib.g', '0'), ('return',)])]
+    linked, removed = link(program)
+    assert removed == ['Main.unused', 'Lib.g']
+    assert [f for f, _ in linked] == ['Sys.vm', 'Main.vm']
+    assert linked[1][1] == program[1][1][:3] + program[1][1][6:]
+    # Without Sys.init nothing is removed
+    assert link(program[1:]) == (program[1:], [])
+    test_unique_labels(link_functions=True)
+
+
+def _push(v):
+    if v == -32768: return 'push constant 32767\nneg\npush constant 1\nsub'
+    return f'push constant {abs(v)}' + ('\nneg' if v < 0 else '')
+
+
+def test_fused_branches(stack_cache=False):
+    "Comparisons and constants followed by if-goto branch like the interpreter."
+    lines = ['function Sys.init 0', 'push constant 3000', 'pop pointer 1']
+    expected = []
+    # (commands, the value they push). Like the unfused comparisons, the
+    # branches compare x-y with 0 so are only exact without overflow.
+    conditions = [([_push(x), _push(y), cmp], -({'eq': x == y, 'gt': x > y, 'lt': x < y}[cmp]))
+                  for x, y in [(3, 5), (5, 3), (4, 4), (-2, 7), (-2, -7)]
+                  for cmp in ['eq', 'gt', 'lt']]
+    conditions += [([f'push constant {c}'], c) for c in [0, 1, 32767]]
+    for condition, value in conditions:
+        for nots in range(3):
+            k = len(expected)
+            lines += condition + ['not']*nots + [f'if-goto TRUE{k}', f'goto END{k}',
+                      f'label TRUE{k}', 'push constant 1', f'pop that {k}', f'label END{k}']
+            expected.append(int((~value if nots % 2 else value) & 0xFFFF != 0))
+    lines += ['label HALT', 'goto HALT']
+
+    with tempfile.TemporaryDirectory() as tmp:
+        f = Path(tmp)/'Sys.vm'
+        f.write_text('\n'.join(lines) + '\n')
+        vm = VMInterpreter(VMProgram([f]))
+        out = io.StringIO()
+        translator([f], out, optimize=True, stack_cache=stack_cache)
+    vm.bootstrap()
+    vm.run()
+    assert 'LOG_' not in out.getvalue()
+    computer = Computer(assemble(remove_comments(io.StringIO(out.getvalue()))))
+    computer.run(10**5)
+    assert computer.ram[0] == vm.ram[0]
+    assert computer.ram[3000:3000+len(expected)] == vm.ram[3000:3000+len(expected)] == expected
+
+
+def test_intrinsics():
+    "The intrinsics must leave the same results and heap as the OS functions."
+    products = [(7, 6), (-3, 5), (300, 300), (-1, -1), (0, 1234), (-32768, 3), (123, -456)]
+    quotients = [(42, 6), (-42, 6), (42, -5), (-42, -5), (7, 9), (32767, 7), (1000, -1), (0, 5)]
+    lines = ['function Sys.init 0', 'call Memory.init 0', 'pop temp 0',
+             'call Math.init 0', 'pop temp 0', 'push constant 3000', 'pop pointer 1']
+    expected = []
+    for op, pairs in [('Math.multiply', products), ('Math.divide', quotients)]:
+        for x, y in pairs:
+            lines += [_push(x), _push(y), f'call {op} 2', f'pop that {len(expected)}']
+            expected.append((x*y if op == 'Math.multiply' else int(x/y)) & 0xFFFF)
+    for size in [3, 10, 1]:
+        lines += [f'push constant {size}', 'call Memory.alloc 1', 'pop temp 0']
+    # A String object built by hand, as String.new needs Output
+    lines += ['push constant 2', 'call Memory.alloc 1', 'pop pointer 0',
+              'push constant 4', 'call Memory.alloc 1', 'pop this 0', 'push constant 0', 'pop this 1',
+              'push pointer 0', 'push constant 72', 'call String.appendChar 2',
+              'push constant 105', 'call String.appendChar 2', 'pop temp 0',
+              'label END', 'goto END', 'function Sys.error 0', 'label ERROR', 'goto ERROR']
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = [Path(tmp)/'Sys.vm']
+        files[0].write_text('\n'.join(lines) + '\n')
+        for name in ['Math', 'Memory', 'Array', 'String']:
+            files.append(Path(tmp)/(name+'.vm'))
+            c = CompilationEngine(Path('../12')/(name+'.jack'), files[-1])
+            c.compile()
+            c.writer.close()
+
+        vm = VMInterpreter(VMProgram(files))
+        vm.bootstrap()
+        vm.run()
+        out = io.StringIO()
+        translator(files, out, intrinsics=True)
+
+    assert '$Math.multiply' in out.getvalue()
+    computer = Computer(assemble(remove_comments(io.StringIO(out.getvalue()))))
+    assert computer.run() < vm.steps
+    assert computer.ram[3000:3000+len(expected)] == vm.ram[3000:3000+len(expected)] == expected
+    assert computer.ram[2048:2100] == vm.ram[2048:2100]
+
 
 if __name__=='__main__':
+    test_stack_and_memory()
     test_program_flow()
     test_function_calls()
+    test_optimized()
+    test_shared_calls()
+    test_shared_compares()
+    test_stack_cache()
+    test_stack_cache_far_pop()
+    test_peephole()
+    test_vm_interpreter()
+    test_vm_interpreter_jack()
+    test_fused_branches()
+    test_link()
+    test_unique_labels()
+    test_intrinsics()
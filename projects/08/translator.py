@@ -8,8 +8,11 @@ Handles memory segments, logical and arithmetic operations,
 branching and function calling.
 """
 
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from pathlib import Path
 from translator_asm import *
+import peephole
 
 def one_arg_asm(*args, **kwargs):
     "Create an unary operation"
@@ -69,31 +72,36 @@ def pop(segment, offset, **kwargs):
     else: raise ValueError(segment, offset)
 
 
-def label(name, **kwargs):
+def scoped(name, function=None):
+    "VM labels are local to their function: `function$name`."
+    return name if function is None else function+'$'+name
+
+
+def label(name, function=None, **kwargs):
     "Add an assembly label"
-    return "("+name+")"
+    return "("+scoped(name, function)+")"
 
 
-def goto(name, **kwargs):
+def goto(name, function=None, **kwargs):
     "Unconditionally jump to `name`"
-    return "@"+name+"\n0;JMP"
+    return "@"+scoped(name, function)+"\n0;JMP"
 
 
-def if_goto(name, **kwargs):
+def if_goto(name, function=None, **kwargs):
     "Conditionally jump to `name` on the last value in the stack."
     return """@SP
 AM=M-1
 D=M
-@"""+name+"\nD;JNE"
+@"""+scoped(name, function)+"\nD;JNE"
 
 
-def init():
+def init(shared_calls=False):
     "Init SP to 256 and call Sys.init"
     return """@256
 D=A
 @SP
 M=D // SP = 256
-""" + call('Sys.init', '0', '0')
+""" + (shared_call if shared_calls else call)('Sys.init', '0', '0')
 
 
 def call(func_name, nargs, i, **kwargs):
@@ -122,6 +130,38 @@ def return_func(**kwargs):
     return return_asm_pre + pop('argument', 0) + return_asm_post
 
 
+def shared_call(func_name, nargs, i, **kwargs):
+    "Call a function through the shared call routine."
+    if nargs in {'0', '1'}:
+        out = "@R13\nM="+nargs+"\n"
+    else:
+        out = "@"+nargs+"\nD=A\n@R13\nM=D\n"
+    out += "@"+func_name+"\nD=A\n" + shared_call_asm
+    return out.format(name=func_name, i=i)
+
+
+def shared_return(**kwargs):
+    "Return from a function through the shared return routine."
+    return shared_return_asm
+
+
+def shared_compare(i, cmp, **kwargs):
+    "Compare through the shared routine of `cmp`."
+    return compare_call_asm.format(cmp=cmp, i=i)
+
+
+def compare_routines(names):
+    """The shared routines of the comparisons `names`, emitted once per
+    program behind a jump, as code without bootstrap runs off its end."""
+    routines = [compare_routine_asm.format(cmp=name.upper()) for name in sorted(names)]
+    return "\n".join(["@$COMPARE.end\n0;JMP", *routines, "($COMPARE.end)"])
+
+
+def shared_routines():
+    "The shared call and return routines, emitted once per program."
+    return shared_call_routine + "\n($RETURN)\n" + return_func()
+
+
 def get_lines(filename):
     "Generate stripped code lines from a text file."
     with open(filename, 'r') as f:
@@ -143,10 +183,16 @@ def get_lines(filename):
                 if len(line)>0:
                     yield line.strip()
 
+def read_commands(filename):
+    "The commands of a .vm file, split into words."
+    return [tuple(w for w in line.split(' ') if len(w)>0) for line in get_lines(filename)]
+
 # Common arguments for commands: args (from vm), filename, line id
 memory_commands = {'push': push, 'pop': pop}
 branch_commands = {'goto': goto, 'if-goto': if_goto, 'label': label}
 func_commands = {'function': function, 'return': return_func, 'call': call}
+shared_commands = {'return': shared_return, 'call': shared_call}
+compare_commands = {cmp: partial(shared_compare, cmp=cmp.upper()) for cmp in ['eq', 'gt', 'lt']}
 
 def get_command(cmd):
     "Get the command for a particular VM function."
@@ -160,16 +206,326 @@ def get_command(cmd):
         return func_commands[cmd]
     raise ValueError('Command not recognized:', cmd)
 
-def translate_file(filename, fileout, annotate=False):
-    "Translate a single file into fileout. Annotate adds block comments."
+# Hand-written routines replacing calls to the projects/12 OS functions
+intrinsic_routines = {
+    'Math.multiply': multiply_asm,
+    'Math.divide': divide_asm,
+    'String.appendChar': append_char_asm,
+    'Memory.alloc': alloc_asm,
+}
+
+
+def intrinsic_call(func_name, nargs, i, **kwargs):
+    "Call the intrinsic routine of an OS function."
+    return intrinsic_call_asm.format(name=func_name, i=i)
+
+
+def intrinsics_asm(names, shared_calls=False):
+    """The intrinsic routines of `names`, emitted once per program, with
+    the shared call routine their fallbacks use."""
+    out = [intrinsic_routines[name] for name in sorted(names)]
+    if not shared_calls and any('@$CALL' in asm for asm in out):
+        out.append(shared_call_routine)
+    return "\n".join(out)
+
+
+def defined_functions(program):
+    "The names of the functions defined in a program of (filename, commands) pairs."
+    return {words[1] for _, commands in program for words in commands if words[0] == 'function'}
+
+
+inverted_jumps = {'EQ': 'NE', 'GT': 'LE', 'LT': 'GE'}
+
+def fuse_branch(commands, i, function=None, template=compare_branch_asm):
+    """Branch directly on `eq|gt|lt not* if-goto` or `push constant not*
+    if-goto` at commands[i], without materializing the boolean. Template
+    is the asm of the comparison branch.
+
+    Returns:
+        The number of commands fused and their asm, or None.
+    """
+    words = commands[i]
+    if not (words[0] in compare_commands or words[0] == 'push' and words[1] == 'constant'):
+        return None
+    j = i+1
+    while j < len(commands) and commands[j][0] == 'not':
+        j += 1
+    if j == len(commands) or commands[j][0] != 'if-goto':
+        return None
+    nots, label = j-i-1, commands[j][1]
+    if words[0] == 'push':
+        value = int(words[2])
+        if nots % 2: value = ~value & 0xFFFF
+        return j-i+1, goto(label, function) if value else ''
+    cmp = words[0].upper()
+    if nots % 2: cmp = inverted_jumps[cmp]
+    return j-i+1, template.format(cmp=cmp, label=scoped(label, function))
+
+
+def call_graph(program):
+    "The functions each function of a program calls."
+    calls = {}
+    for _, commands in program:
+        callees = None
+        for words in commands:
+            if words[0] == 'function':
+                callees = calls.setdefault(words[1], set())
+            elif words[0] == 'call' and callees is not None:
+                callees.add(words[1])
+    return calls
+
+
+def link(program, roots=('Sys.init',)):
+    """Drop the functions of a program that no chain of calls from `roots`
+    reaches, and the files left empty. A program without any of the roots
+    is kept whole.
+
+    Returns:
+        The linked program and the names of the functions removed.
+    """
+    calls = call_graph(program)
+    reached = set()
+    todo = [root for root in roots if root in calls]
+    if not todo:
+        return program, []
+    while todo:
+        func = todo.pop()
+        if func not in reached:
+            reached.add(func)
+            todo.extend(calls.get(func, ()))
+
+    linked, removed = [], []
+    for f, commands in program:
+        kept = []
+        keep = True
+        for words in commands:
+            if words[0] == 'function':
+                keep = words[1] in reached
+                if not keep: removed.append(words[1])
+            if keep: kept.append(words)
+        if kept: linked.append((f, kept))
+    return linked, removed
+
+
+def load_d(segment, offset, **kwargs):
+    "Load a value from a memory segment into D."
+    if segment == 'constant' and offset in {'0', '1'}:
+        return 'D='+offset
+    if segment in push_segments:
+        base = push_segments[segment]
+        if offset in {'0', '1'}:
+            return '@'+base+'\nA=M'+('+1' if offset == '1' else '')+'\nD=M'
+        return '@'+base+'\nD=M\n@'+offset+'\nA=D+A\nD=M'
+    if segment in addr_segments:
+        return '@{addr}\nD={val}'.format(**addr_segments[segment](offset, **kwargs))
+    raise ValueError(segment, offset)
+
+
+def move(src_segment, src_offset, segment, offset, **kwargs):
+    """Copy a value between memory segments without using the stack.
+    Equivalent to `push src_segment src_offset` then `pop segment offset`."""
+    assert segment != 'constant'
+    # Compute the destination address first, as it uses D
+    pre = ''
+    if segment in addr_segments:
+        store = '@{addr}\nM={{val}}'.format(**addr_segments[segment](offset, **kwargs))
+    elif offset in {'0', '1'}:
+        store = '@'+push_segments[segment]+'\nA=M'+('+1' if offset == '1' else '')+'\nM={val}'
+    else:
+        pre = seg_address.format(segment=push_segments[segment], addr=offset) + '\n'
+        store = '@R13\nA=M\nM={val}'
+
+    if src_segment == 'constant' and src_offset in {'0', '1'}:
+        return pre + store.format(val=src_offset)
+    return pre + load_d(src_segment, src_offset, **kwargs) + '\n' + store.format(val='D')
+
+
+def store_d(segment, offset, **kwargs):
+    """Pop the top of the stack, held in D, to a memory segment. Far
+    offsets of the pointer segments keep D in R13 while adding them up."""
+    assert segment != 'constant'
+    if segment in addr_segments:
+        return '@{addr}\nM=D'.format(**addr_segments[segment](offset, **kwargs))
+    n = int(offset)
+    if n > 3:
+        return cached_seg_pop.format(segment=push_segments[segment], addr=offset)
+    return '@'+push_segments[segment]+'\nA=M'+('+1' if n else '')+'\nA=A+1'*max(n-1, 0)+'\nM=D'
+
+cached_binary = {'add': 'D+M', 'sub': 'M-D', 'and': 'D&M', 'or': 'D|M'}
+cached_unary = {'neg': 'D=-D', 'not': 'D=!D'}
+
+def generate_asm(filename, commands, annotate=False, fuse=False, shared_calls=False,
+                 intrinsics=(), shared_compares=False):
+    """Generate the asm for each command of a file, given as tuples of words.
+    Annotate adds block comments. Fuse translates `push` followed by `pop`
+    with `move`, and comparisons or constants followed by `if-goto` with
+    `fuse_branch`. Shared_calls uses the shared call and return routines.
+    Calls to the functions in `intrinsics` jump to their intrinsic routines.
+    Shared_compares jumps to one shared routine per comparison.
+
+    The labels generated for a command (return addresses, comparisons) are
+    named after the file stem and the command's index in the file, and the
+    labels of the VM code are scoped to their function, so files can be
+    translated independently of each other."""
     fn = Path(filename).stem
-    for i,line in enumerate(get_lines(filename)):
-        words = [w for w in line.split(' ') if len(w)>0]
-        if annotate: print('\n// '+line, file=fileout)
+    func = None
+    i = 0
+    while i < len(commands):
+        words = commands[i]
+        if words[0] == 'function': func = words[1]
+        if annotate: yield '\n// '+' '.join(words)
+        if fuse and words[0] == 'push' and i+1 < len(commands) and commands[i+1][0] == 'pop':
+            next_words = commands[i+1]
+            if annotate: yield '// '+' '.join(next_words)
+            yield move(*words[1:], *next_words[1:], filename=fn)
+            i += 2
+            continue
+        branch = fuse_branch(commands, i, func) if fuse else None
+        if branch is not None:
+            n, asm = branch
+            if annotate:
+                for fused in commands[i+1:i+n]: yield '// '+' '.join(fused)
+            if asm: yield asm
+            i += n
+            continue
         cmd = get_command(words[0])
-        print(cmd(*words[1:], i=i, filename=fn), file=fileout)
-
-def translator(filenames, fileout, annotate=False):
+        if shared_calls: cmd = shared_commands.get(words[0], cmd)
+        if shared_compares: cmd = compare_commands.get(words[0], cmd)
+        if words[0] == 'call' and words[1] in intrinsics: cmd = intrinsic_call
+        yield cmd(*words[1:], i=f'{fn}.{i}', filename=fn, function=func)
+        i += 1
+
+def generate_cached_asm(filename, commands, annotate=False, shared_calls=False, intrinsics=(),
+                        shared_compares=False):
+    """Generate the asm for each command of a file like `generate_asm`,
+    keeping the top of the VM stack in D between commands.
+
+    A pushed value stays in D until a later command of the basic block
+    consumes it, and is spilled to RAM only under another push and before
+    labels, jumps, calls and returns, so every label is reached with the
+    whole stack in RAM. Conditional branches are fused as with `fuse`."""
+    fn = Path(filename).stem
+    func = None
+    cached = False      # Whether D holds the top of the stack
+    i = 0
+    while i < len(commands):
+        words = commands[i]
+        if annotate: yield '\n// '+' '.join(words)
+        op = words[0]
+        branch = fuse_branch(commands, i, func,
+                             cached_compare_branch_asm if cached else compare_branch_asm)
+        if branch is not None:
+            n, asm = branch
+            if annotate:
+                for fused in commands[i+1:i+n]: yield '// '+' '.join(fused)
+            if op == 'push' and cached and asm:
+                yield spill_asm
+            if op != 'push' or asm:
+                yield asm
+                cached = False
+            i += n
+            continue
+
+        if op == 'push':
+            if cached: yield spill_asm
+            yield load_d(*words[1:], filename=fn)
+            cached = True
+        elif op == 'pop' and not cached and words[1] in push_segments and int(words[2]) > 3:
+            # Popping from the stack directly is shorter than through D
+            yield pop(*words[1:], filename=fn)
+        elif op in {'pop', 'if-goto'} or op in cached_binary or op in cached_unary or (
+                op in compare_commands and not shared_compares):
+            if not cached: yield pop_d_asm
+            if op == 'pop':
+                yield store_d(*words[1:], filename=fn)
+            elif op == 'if-goto':
+                yield '@'+scoped(words[1], func)+'\nD;JNE'
+            elif op in cached_binary:
+                yield cached_2_args.format(op=cached_binary[op])
+            elif op in cached_unary:
+                yield cached_unary[op]
+            else:
+                yield cached_log_2_args.format(cmp=op.upper(), uuid=f'{fn}.{i}')
+            cached = op not in {'pop', 'if-goto'}
+        else:
+            if cached: yield spill_asm
+            cached = False
+            if op == 'function': func = words[1]
+            cmd = get_command(op)
+            if shared_calls: cmd = shared_commands.get(op, cmd)
+            if shared_compares: cmd = compare_commands.get(op, cmd)
+            if op == 'call' and words[1] in intrinsics: cmd = intrinsic_call
+            yield cmd(*words[1:], i=f'{fn}.{i}', filename=fn, function=func)
+        i += 1
+    if cached: yield spill_asm
+
+def translate_commands(filename, commands, annotate=False, optimize=False, shared_calls=False,
+                       intrinsics=(), shared_compares=False, stack_cache=False):
+    """Translate the commands of a single file. Annotate adds block comments.
+    Optimize fuses push/pop pairs and conditional branches, and applies the
+    peephole optimizer. Stack_cache keeps the top of the stack in D.
+
+    Returns:
+        The list of asm blocks, and the number of instructions before and
+        after optimization (None without optimize).
+    """
+    options = dict(shared_calls=shared_calls, intrinsics=intrinsics, shared_compares=shared_compares)
+    if stack_cache:
+        asm = generate_cached_asm(filename, commands, annotate, **options)
+    else:
+        asm = generate_asm(filename, commands, annotate, fuse=optimize, **options)
+    if not optimize:
+        return list(asm), None
+
+    before = peephole.count_instructions(peephole.parse_asm('\n'.join(generate_asm(
+        filename, commands, **options))))
+    instructions = peephole.optimize(peephole.parse_asm('\n'.join(asm)))
+    return instructions, (before, peephole.count_instructions(instructions))
+
+def translate_program(program, annotate=False, bootstrap=True, optimize=False,
+                      shared_calls=False, intrinsics=False, verbose=True, jobs=1,
+                      shared_compares=False, stack_cache=False, link_functions=False):
+    """Generate the asm blocks of a program, a list of (filename, commands)
+    pairs where commands are tuples of words, e.g. ('push', 'constant', '7').
+    The parameters are those of `translator`; verbose prints the progress."""
+    if link_functions:
+        program, removed = link(program)
+        if verbose and removed:
+            print(f'Removed {len(removed)} unreachable functions: {", ".join(removed)}')
+    intrinsics = defined_functions(program) & intrinsic_routines.keys() if intrinsics else set()
+    if annotate: yield "// Generated hack asm file."
+    if bootstrap:
+        if annotate: yield "\n// Init sys call."
+        yield init(shared_calls)
+    filenames = [f for f, _ in program]
+    translate = partial(translate_commands, annotate=annotate, optimize=optimize,
+                        shared_calls=shared_calls, intrinsics=intrinsics,
+                        shared_compares=shared_compares, stack_cache=stack_cache)
+    if jobs == 1:
+        results = map(translate, filenames, [commands for _, commands in program])
+    else:
+        with ProcessPoolExecutor(jobs or None) as pool:
+            results = list(pool.map(translate, filenames, [commands for _, commands in program]))
+    for f, (asm, counts) in zip(filenames, results):
+        if verbose: print(f'Translating {f}')
+        yield from asm
+        if verbose and counts is not None:
+            before, after = counts
+            print(f'  {before} -> {after} instructions ({before-after} saved)')
+    if shared_calls:
+        if annotate: yield "\n// Shared call and return routines."
+        yield shared_routines()
+    if intrinsics:
+        if annotate: yield "\n// OS function intrinsics."
+        yield intrinsics_asm(intrinsics, shared_calls)
+    compares = {words[0] for _, commands in program for words in commands} & compare_commands.keys()
+    if shared_compares and compares:
+        if annotate: yield "\n// Shared comparison routines."
+        yield compare_routines(compares)
+
+def translator(filenames, fileout, annotate=False, bootstrap=True, optimize=False,
+               shared_calls=False, intrinsics=False, jobs=1, shared_compares=False,
+               stack_cache=False, link_functions=False):
     """Translate a set of files into a single output file `fileout`.
     Initialises the stack pointer to 256 and calls the sys function
     init before translating other code.
@@ -178,12 +534,28 @@ def translator(filenames, fileout, annotate=False):
         filenames (list): a list of .vm filenames the translate.
         fileout (str): the file handle to write to.
         annotate (bool): add block comments to the generated asm.
+        bootstrap (bool): emit the SP and Sys.init bootstrap code.
+        optimize (bool): optimize the generated asm, reporting the
+            number of instructions saved per file.
+        shared_calls (bool): emit one shared call and one shared return
+            routine, jumped to from every call and return.
+        intrinsics (bool): replace the calls to Math.multiply, Math.divide,
+            String.appendChar and Memory.alloc of the projects/12 OS with
+            hand-written assembly routines.
+        jobs (int): translate the files in N worker processes (0 for one
+            per core). The output is the same as translating in order.
+        shared_compares (bool): emit one shared routine per comparison
+            (eq, gt, lt), jumped to from every comparison.
+        stack_cache (bool): keep the top of the VM stack in D within basic
+            blocks instead of in RAM.
+        link_functions (bool): drop the functions not reachable through
+            calls from Sys.init, reporting the functions removed.
     """
-    if annotate: print("// Generated hack asm file.\n\n// Init sys call.", file=fileout)
-    print(init(), file=fileout)
-    for f in filenames:
-        print(f'Translating {f}')
-        translate_file(f, fileout, annotate)
+    program = [(f, read_commands(f)) for f in filenames]
+    for block in translate_program(program, annotate, bootstrap, optimize, shared_calls,
+                                   intrinsics, jobs=jobs, shared_compares=shared_compares,
+                                   stack_cache=stack_cache, link_functions=link_functions):
+        print(block, file=fileout)
 
 if __name__=='__main__':
     import argparse
@@ -195,15 +567,35 @@ if __name__=='__main__':
                         help='Filename of the output.')
     parser.add_argument('--annotate', action='store_true',
                         help='Annotate the asm file with comments.')
+    parser.add_argument('--no-bootstrap', action='store_true',
+                        help='Do not emit the bootstrap code that calls Sys.init.')
+    parser.add_argument('--optimize', '-O', action='store_true',
+                        help='Optimize the generated asm.')
+    parser.add_argument('--shared-calls', action='store_true',
+                        help='Use shared call/return routines to reduce code size.')
+    parser.add_argument('--intrinsics', action='store_true',
+                        help='Replace calls to hot OS functions with assembly routines.')
+    parser.add_argument('--shared-compares', action='store_true',
+                        help='Use shared eq/gt/lt routines to reduce code size.')
+    parser.add_argument('--stack-cache', action='store_true',
+                        help='Keep the top of the stack in the D register.')
+    parser.add_argument('--link', action='store_true',
+                        help='Drop the functions Sys.init never calls, directly or not.')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Translate the files in N processes (0 for one per core).')
 
     args = parser.parse_args()
 
     f0 = Path(args.filename[0])
     if len(args.filename)==1 and f0.is_dir():
-        args.filename = [str(p) for p in f0.iterdir() if p.suffix == '.vm']
+        args.filename = sorted(str(p) for p in f0.iterdir() if p.suffix == '.vm')
 
     if args.output is None:
         fout = str(f0/f0.stem)+'.asm' if f0.is_dir() else str(f0.parent/f0.stem)+'.asm'
 
     with open(args.output or fout, 'w') as fout:
-        translator(args.filename, fout, annotate=args.annotate)
+        translator(args.filename, fout, annotate=args.annotate,
+                   bootstrap=not args.no_bootstrap, optimize=args.optimize,
+                   shared_calls=args.shared_calls, intrinsics=args.intrinsics, jobs=args.jobs,
+                   shared_compares=args.shared_compares, stack_cache=args.stack_cache,
+                   link_functions=args.link)
@@ -40,6 +40,44 @@ A=M-1
 M=-1
 (LOG_{cmp}_false.{uuid})"""
 
+# Pop 2 args and jump to {label} if arg1 {cmp} arg2
+compare_branch_asm = """@SP
+AM=M-1
+D=M // D=*SP
+A=A-1
+D=M-D
+@SP
+M=M-1
+@{label}
+D;J{cmp}"""
+
+# Call site of a shared comparison routine, D = return address
+compare_call_asm = """@${cmp}$ret.{i}
+D=A // D = return address
+@${cmp}
+0;JMP
+(${cmp}$ret.{i})"""
+
+# Replace the 2 args by -1 if arg1 {cmp} arg2 else 0 and return to R15
+compare_routine_asm = """(${cmp})
+@R15
+M=D // R15 = return address
+@SP
+AM=M-1
+D=M // D=*SP
+A=A-1
+D=M-D
+M=-1
+@${cmp}.true
+D;J{cmp}
+@SP
+A=M-1
+M=0
+(${cmp}.true)
+@R15
+A=M
+0;JMP"""
+
 # apply an operation to 1 arg
 asm_1_arg = "M={op}M // *SP=D"
 
@@ -61,13 +99,16 @@ M=D
 @SP
 M=M+1"""
 
-# pop to a segment of memory
-seg_pop = """@{segment}
+# store the address of a segment offset in R13
+seg_address = """@{segment}
 D=M // D=base_addr
 @{addr} // offset
 D=D+A // D = base_addr+offset
 @R13
-M=D
+M=D"""
+
+# pop to a segment of memory
+seg_pop = seg_address + """
 @SP
 AM=M-1 //SP--
 D=M // D=val
@@ -168,3 +209,397 @@ M=D // LCL = *(LCL-4)
 @R15
 A=M
 0;JMP // goto lcl-5 == retAddr"""
+
+
+
+#########################################
+###     Shared call/return routines   ###
+#########################################
+
+# Push D to the stack
+push_d = """@SP
+AM=M+1
+A=A-1
+M=D"""
+
+# Call site of the shared call routine:
+# R13 = nargs, R14 = function, D = return address
+shared_call_asm = """@R14
+M=D // R14 = function
+@{name}$ret.{i}
+D=A // D = return address
+@$CALL
+0;JMP
+({name}$ret.{i})"""
+
+# Save the caller's frame, set ARG and LCL and jump to the function in R14
+shared_call_routine = "($CALL)\n" + push_d + " // push return address\n" + "\n".join(
+    "@{0}\nD=M\n{1} // push {0}".format(seg, push_d) for seg in ['LCL', 'ARG', 'THIS', 'THAT']
+) + """
+@R13
+D=M
+@5
+D=D+A
+@SP
+D=M-D // D=SP-5-nargs
+@ARG
+M=D // ARG = SP-5-nargs
+@SP
+D=M
+@LCL
+M=D // LCL = SP
+@R14
+A=M
+0;JMP"""
+
+# Return site of the shared return routine
+shared_return_asm = """@$RETURN
+0;JMP"""
+
+
+
+#########################################
+###        OS function intrinsics     ###
+#########################################
+
+# Call site of an intrinsic: the arguments are on the stack, D = return
+# address. The routine replaces the arguments with the result.
+intrinsic_call_asm = """@{name}$intrinsic.{i}
+D=A // D = return address
+@${name}
+0;JMP
+({name}$intrinsic.{i})"""
+
+# Fall back to the VM function with the arguments still on the stack,
+# through the shared call routine
+intrinsic_fallback_asm = """@{nargs}
+D=A
+@R13
+M=D // R13 = nargs
+@{name}
+D=A
+@R14
+M=D // R14 = function
+@${name}.ret
+D=M // D = return address
+@$CALL
+0;JMP"""
+
+# Math.multiply(x, y): shift and add over the set bits of x
+multiply_asm = """($Math.multiply)
+@$Math.multiply.ret
+M=D
+@SP
+AM=M-1
+D=M
+@$Math.multiply.y
+M=D // y
+@SP
+A=M-1
+D=M
+@$Math.multiply.x
+M=D // x
+@SP
+A=M-1
+M=0 // sum = 0
+@$Math.multiply.bit
+M=1
+($Math.multiply.loop)
+@$Math.multiply.x
+D=M
+@$Math.multiply.end
+D;JEQ // no bits of x left
+@$Math.multiply.bit
+D=D&M
+@$Math.multiply.next
+D;JEQ
+@$Math.multiply.bit
+D=M
+@$Math.multiply.x
+M=M-D // clear the bit
+@$Math.multiply.y
+D=M
+@SP
+A=M-1
+M=M+D // sum += y
+($Math.multiply.next)
+@$Math.multiply.y
+D=M
+M=D+M // y += y
+@$Math.multiply.bit
+D=M
+M=D+M // bit += bit
+@$Math.multiply.loop
+0;JMP
+($Math.multiply.end)
+@$Math.multiply.ret
+A=M
+0;JMP"""
+
+# Math.divide(x, y): long division of |x| by |y|. y = 0 and x or y
+# = -32768 fall back to the VM function.
+divide_asm = """($Math.divide)
+@$Math.divide.ret
+M=D
+@$Math.divide.sign
+M=0
+@SP
+AM=M-1
+D=M // y
+@$Math.divide.slow
+D;JEQ
+@$Math.divide.b
+M=D
+@$Math.divide.y_pos
+D;JGT
+@$Math.divide.b
+M=-D
+D=M
+@$Math.divide.slow
+D;JLT // y = -32768
+@$Math.divide.sign
+M=!M
+($Math.divide.y_pos)
+@SP
+A=M-1
+D=M // x
+@$Math.divide.a
+M=D
+@$Math.divide.x_pos
+D;JGE
+@$Math.divide.a
+M=-D
+D=M
+@$Math.divide.slow
+D;JLT // x = -32768
+@$Math.divide.sign
+M=!M
+($Math.divide.x_pos)
+@$Math.divide.r
+M=0
+@$Math.divide.q
+M=0
+@$Math.divide.a
+D=M
+M=D+M // bit 15 of |x| is 0, start from bit 14
+@15
+D=-A
+@$Math.divide.i
+M=D
+($Math.divide.loop)
+@$Math.divide.r
+D=M
+M=D+M // r += r
+@$Math.divide.a
+D=M
+M=D+M // shift the next bit of x out of a
+@$Math.divide.shifted
+D;JGE
+@$Math.divide.r
+M=M+1
+($Math.divide.shifted)
+@$Math.divide.q
+D=M
+M=D+M // q += q
+@$Math.divide.b
+D=M
+@$Math.divide.r
+D=M-D
+@$Math.divide.next
+D;JLT
+@$Math.divide.r
+M=D // r -= b
+@$Math.divide.q
+M=M+1
+($Math.divide.next)
+@$Math.divide.i
+M=M+1
+D=M
+@$Math.divide.loop
+D;JLT
+@$Math.divide.sign
+D=M
+@$Math.divide.done
+D;JEQ
+@$Math.divide.q
+M=-M // the signs differ
+($Math.divide.done)
+@$Math.divide.q
+D=M
+@SP
+A=M-1
+M=D
+@$Math.divide.ret
+A=M
+0;JMP
+($Math.divide.slow)
+@SP
+M=M+1 // push y back
+""" + intrinsic_fallback_asm.format(name='Math.divide', nargs=2)
+
+# String.appendChar(this, c): chars = this[0], len = this[1]
+append_char_asm = """($String.appendChar)
+@$String.appendChar.ret
+M=D
+@SP
+AM=M-1
+D=M
+@R14
+M=D // c
+@SP
+A=M-1
+A=M
+D=M
+A=A+1
+D=D+M
+@R13
+M=D // R13 = chars + len
+@R14
+D=M
+@R13
+A=M
+M=D // chars[len] = c
+@SP
+A=M-1
+A=M+1
+M=M+1 // len = len + 1
+@$String.appendChar.ret
+A=M
+0;JMP"""
+
+# Memory.alloc(size): first fit over the free list of Memory.jack, whose
+# statics are ram, heap, freeList, curBlock and prevBlock. Blocks are
+# [next, size, data...]. A full heap falls back to the VM function.
+alloc_asm = """($Memory.alloc)
+@$Memory.alloc.ret
+M=D
+@SP
+A=M-1
+D=M
+@$Memory.alloc.size
+M=D
+($Memory.alloc.loop)
+@Memory.Static.3
+A=M+1
+D=M // curSize = curBlock[1]
+@$Memory.alloc.size
+D=D-M
+@2
+D=D-A // nxtSize = curSize-size-2
+@$Memory.alloc.next
+D;JLT // curSize < size+2
+@$Memory.alloc.nxt_size
+M=D
+@Memory.Static.3
+D=M
+@2
+D=D+A
+@SP
+A=M-1
+M=D // return curBlock+2
+@Memory.Static.3
+A=M+1
+M=0 // curBlock[1] = 0
+@Memory.Static.3
+D=M
+@$Memory.alloc.size
+D=D+M
+@2
+D=D+A
+@$Memory.alloc.nxt
+M=D // nxtAddr = curBlock+size+2
+@Memory.Static.3
+A=M
+D=M
+@$Memory.alloc.nxt
+A=M
+M=D // nxtAddr[0] = curBlock[0]
+@$Memory.alloc.nxt_size
+D=M
+@$Memory.alloc.nxt
+A=M+1
+M=D // nxtAddr[1] = nxtSize
+@$Memory.alloc.nxt
+D=M
+@Memory.Static.3
+A=M
+M=D // curBlock[0] = nxtAddr
+@Memory.Static.2
+D=M
+@Memory.Static.3
+M=D // curBlock = freeList
+@$Memory.alloc.ret
+A=M
+0;JMP
+($Memory.alloc.next)
+@Memory.Static.3
+A=M
+D=M
+@$Memory.alloc.slow
+D;JEQ // curBlock[0] = null
+@Memory.Static.3
+D=M
+@Memory.Static.4
+M=D // prevBlock = curBlock
+A=D
+D=M
+@Memory.Static.3
+M=D // curBlock = curBlock[0]
+@$Memory.alloc.loop
+0;JMP
+($Memory.alloc.slow)
+""" + intrinsic_fallback_asm.format(name='Memory.alloc', nargs=1)
+
+
+
+#########################################
+###      Top-of-stack caching in D    ###
+#########################################
+
+# Store the top of the stack, held in D, to the stack
+spill_asm = """@SP
+AM=M+1
+A=A-1
+M=D // *(SP-1)=D"""
+
+# Pop the top of the stack into D
+pop_d_asm = """@SP
+AM=M-1
+D=M // D=*SP"""
+
+# Pop D to a far segment offset: D=val+addr, so addr and val are recovered
+# from it with val held in R13, without going through the stack
+cached_seg_pop = """@R13
+M=D // R13=val
+@{segment}
+D=D+M
+@{addr}
+D=D+A // D=val+addr
+@R13
+A=D-M // A=addr
+M=D-A // *addr=val"""
+
+# Replace D, the top of the stack, with arg1 {op} D
+cached_2_args = """@SP
+AM=M-1
+D={op}"""
+
+# Replace D with -1 if arg1 {cmp} D else 0
+cached_log_2_args = """@SP
+AM=M-1
+D=M-D
+@LOG_{cmp}_true.{uuid}
+D;J{cmp}
+D=0
+@LOG_{cmp}_false.{uuid}
+0;JMP
+(LOG_{cmp}_true.{uuid})
+D=-1
+(LOG_{cmp}_false.{uuid})"""
+
+# Pop arg1 and jump to {label} if arg1 {cmp} D
+cached_compare_branch_asm = """@SP
+AM=M-1
+D=M-D
+@{label}
+D;J{cmp}"""
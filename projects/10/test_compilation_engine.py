@@ -1,5 +1,7 @@
 from pathlib import Path
-from CompilationEngine import CompilationEngine
+import tempfile
+
+from CompilationEngine import CompilationEngine, JackSyntaxError
 
 def wrap_test_path(path):
     def _inner():
@@ -18,7 +20,19 @@ test_square = wrap_test_path('Square')
 test_expression_less_square = wrap_test_path('ExpressionLessSquare')
 test_array = wrap_test_path('ArrayTest')
 
+def test_syntax_error_position():
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp)/'Main.jack'
+        source.write_text('class Main {\n  function void f() {\n    let x = (1')
+        try:
+            CompilationEngine(source, Path(tmp)/'Main.xml').compile()
+            assert False, 'Expected an error'
+        except JackSyntaxError as e:
+            assert (e.line, e.column) == (3, 14)
+            assert str(e) == f'{source}:3:14: Unexpected end of file'
+
 if __name__ == '__main__':
     test_square()
     test_expression_less_square()
     test_array()
+    test_syntax_error_position()
@@ -0,0 +1,35 @@
+"Measure tokenizer throughput in tokens/sec over the projects/09-12 .jack files."
+
+from pathlib import Path
+import time
+
+from jack_tokenizer import JackTokenizer
+
+PROJECTS = Path(__file__).resolve().parent.parent
+CORPUS = ['09', '10', '11', '12']
+
+def corpus_files():
+    return sorted(f for p in CORPUS for f in (PROJECTS/p).rglob('*.jack'))
+
+def bench(filenames, repeat=10, mmap=False):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        n = sum(sum(1 for _ in JackTokenizer(fn, mmap)) for fn in filenames)
+    elapsed = (time.perf_counter() - start) / repeat
+    return n, elapsed
+
+if __name__=='__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Jack tokenizer benchmark.')
+    parser.add_argument('filename', type=str, nargs='*',
+                        help='Files to tokenize (default: the projects/09-12 .jack files).')
+    parser.add_argument('--repeat', '-r', type=int, default=10,
+                        help='Number of timed runs.')
+    parser.add_argument('--mmap', '-m', action='store_true',
+                        help='Memory-map the files and tokenize them as bytes.')
+
+    args = parser.parse_args()
+    filenames = args.filename or corpus_files()
+    n, t = bench(filenames, args.repeat, args.mmap)
+    print(f'{len(filenames)} files: {n} tokens in {t*1000:.1f}ms ({n/t:,.0f} tokens/sec)')
@@ -0,0 +1,201 @@
+"""Expression trees for the optimizing compilation of Jack expressions.
+
+An expression is parsed into a tree of constants, operators and `Code`
+leaves holding the VM commands of any other term (variables, calls,
+array lookups, strings). `fold` rewrites the tree:
+- operators over constants are evaluated at compile time, with 16-bit
+  wraparound and Math.divide's truncation toward zero;
+- identities such as x+0, x*1 and x/1 drop the operation;
+- (x+a)+b and (x-a)+b become a single addition of a constant;
+- multiplication by a constant with few set bits becomes doublings and
+  additions, and by 0 or -1 a constant or a negation, so Math.multiply
+  is not called.
+
+Values are unsigned 16-bit ints, like the VM's.
+"""
+
+OPERATIONS = {'+': 'add', '-': 'sub', '&': 'and', '|': 'or', '<': 'lt', '>': 'gt', '=': 'eq'}
+UNARY_OPERATIONS = {'-': 'neg', '~': 'not'}
+CALLS = {'*': 'Math.multiply', '/': 'Math.divide'}
+# Temp registers of Scale, temp 0 being taken by array assignments
+OPERAND_TEMP = 1
+DOUBLE_TEMP = 2
+# Factors with more set bits are left to Math.multiply to bound code size
+MAX_SCALE_BITS = 4
+
+def signed(v):
+    return v - 0x10000 if v & 0x8000 else v
+
+def _divide(x, y):
+    "Math.divide's result, or None where it is undefined or diverges."
+    if y == 0 or 0x8000 in (x, y): return None
+    q = abs(signed(x)) // abs(signed(y))
+    return q if (x ^ y) & 0x8000 == 0 else -q
+
+EVALUATE = {
+    '+': lambda x, y: x + y,
+    '-': lambda x, y: x - y,
+    '*': lambda x, y: x * y,
+    '/': _divide,
+    '&': lambda x, y: x & y,
+    '|': lambda x, y: x | y,
+    '<': lambda x, y: -(signed(x) < signed(y)),
+    '>': lambda x, y: -(signed(x) > signed(y)),
+    '=': lambda x, y: -(x == y),
+}
+
+class Const:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value & 0xFFFF
+
+    def emit(self, writer):
+        if self.value < 0x8000:
+            writer.write_push('constant', self.value)
+        else:
+            # Negative values are the complement of a pushable constant
+            writer.write_push('constant', self.value ^ 0xFFFF)
+            writer.write_arithmetic('not')
+
+    @property
+    def pure(self):
+        return True
+
+class Code:
+    "VM commands (as word tuples) pushing the value of a term the tree does not model."
+    __slots__ = ('commands',)
+
+    def __init__(self, commands):
+        self.commands = commands
+
+    def emit(self, writer):
+        for words in self.commands: writer.write(*words)
+
+    @property
+    def pure(self):
+        "Whether the code can be dropped: it calls nothing."
+        return not any(words[0] == 'call' for words in self.commands)
+
+class Unary:
+    __slots__ = ('op', 'operand')
+
+    def __init__(self, op, operand):
+        self.op = op
+        self.operand = operand
+
+    def emit(self, writer):
+        self.operand.emit(writer)
+        writer.write_arithmetic(UNARY_OPERATIONS[self.op])
+
+    @property
+    def pure(self):
+        return self.operand.pure
+
+class Binary:
+    __slots__ = ('op', 'left', 'right')
+
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+    def emit(self, writer):
+        self.left.emit(writer)
+        self.right.emit(writer)
+        if self.op in CALLS: writer.write_call(CALLS[self.op], 2)
+        else: writer.write_arithmetic(OPERATIONS[self.op])
+
+    @property
+    def pure(self):
+        return self.left.pure and self.right.pure
+
+class Scale:
+    """The operand times a constant factor, by shifts (doublings) and
+    additions instead of a Math.multiply call."""
+    __slots__ = ('operand', 'factor')
+
+    def __init__(self, operand, factor):
+        self.operand = operand
+        self.factor = factor
+
+    def emit(self, writer):
+        bits = bin(self.factor)[3:]
+        operand = self.operand
+        operand.emit(writer)
+        if not (isinstance(operand, Code) and len(operand.commands) == 1 and operand.pure):
+            if '1' in bits:
+                writer.write_pop('temp', OPERAND_TEMP)
+                writer.write_push('temp', OPERAND_TEMP)
+            operand = Code([('push', 'temp', str(OPERAND_TEMP))])
+        elif self.factor == 2:
+            # A single push can simply be repeated
+            operand.emit(writer)
+            writer.write_arithmetic('add')
+            return
+        # Binary multiplication from the highest bit down
+        for bit in bits:
+            writer.write_pop('temp', DOUBLE_TEMP)
+            writer.write_push('temp', DOUBLE_TEMP)
+            writer.write_push('temp', DOUBLE_TEMP)
+            writer.write_arithmetic('add')
+            if bit == '1':
+                operand.emit(writer)
+                writer.write_arithmetic('add')
+
+    @property
+    def pure(self):
+        return self.operand.pure
+
+def _scalable(v):
+    "Whether multiplying by v is cheaper as shifts and additions."
+    return 1 < v <= 0x8000 and bin(v).count('1') <= MAX_SCALE_BITS
+
+def fold(node):
+    "Return an equivalent tree with constants folded and cheaper operations."
+    if isinstance(node, Unary):
+        operand = fold(node.operand)
+        if isinstance(operand, Const):
+            return Const(-operand.value if node.op == '-' else ~operand.value)
+        if isinstance(operand, Unary) and operand.op == node.op:
+            return operand.operand
+        return Unary(node.op, operand)
+    if isinstance(node, Binary):
+        return _fold_binary(node.op, fold(node.left), fold(node.right))
+    return node
+
+def _fold_binary(op, left, right):
+    lc, rc = isinstance(left, Const), isinstance(right, Const)
+    if lc and rc:
+        value = EVALUATE[op](left.value, right.value)
+        if value is not None: return Const(value)
+        return Binary(op, left, right)
+
+    if op in '+-' and rc:
+        if right.value == 0: return left
+        # (x ± a) ± b -> x + (±a ± b)
+        if isinstance(left, Binary) and left.op in '+-' and isinstance(left.right, Const):
+            a = left.right.value if left.op == '+' else -left.right.value
+            b = right.value if op == '+' else -right.value
+            return _fold_binary('+', left.left, Const(a + b))
+        if right.value > 0x8000:
+            # Subtract a negative constant rather than pushing it
+            return Binary('-' if op == '+' else '+', left, Const(-right.value))
+    if op == '+' and lc and left.value == 0: return right
+    if op == '-' and lc and left.value == 0: return Unary('-', right)
+
+    if op == '*':
+        if lc: left, right, rc = right, left, True    # Constants have no side effects
+        if rc:
+            v = right.value
+            if v == 0 and left.pure: return Const(0)
+            if v == 1: return left
+            if v == 0xFFFF: return Unary('-', left)
+            if isinstance(left, Scale): return _fold_binary('*', left.operand, Const(left.factor * v))
+            if _scalable(v): return Scale(left, v)
+            if _scalable(-v & 0xFFFF): return Unary('-', Scale(left, -v & 0xFFFF))
+    if op == '/' and rc and right.value == 1: return left
+
+    if op == '&' and rc and right.value == 0xFFFF: return left
+    if op == '|' and rc and right.value == 0: return left
+    return Binary(op, left, right)
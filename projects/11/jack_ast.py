@@ -0,0 +1,94 @@
+"""Abstract syntax tree of a Jack class, as built by `JackParser`.
+
+Nodes keep the offset of their first token in the source so later passes
+can report errors at the right place. Code generators subclass `Visitor`
+and implement a `visit_<NodeClass>` method per node type they handle.
+"""
+
+class Node:
+    __slots__ = ('offset',)
+
+    def __init__(self, *values, offset=None):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+        self.offset = offset
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        values = ', '.join(repr(getattr(self, name)) for name in self.__slots__)
+        return f'{type(self).__name__}({values})'
+
+# Declarations
+
+class Class(Node):
+    __slots__ = ('name', 'class_vars', 'subroutines')
+
+class ClassVarDec(Node):
+    "`kind` is static or field."
+    __slots__ = ('kind', 'type', 'names')
+
+class SubroutineDec(Node):
+    "`parameters` is a list of (type, name) pairs and `locals` of VarDecs."
+    __slots__ = ('kind', 'return_type', 'name', 'parameters', 'locals', 'statements')
+
+class VarDec(Node):
+    __slots__ = ('type', 'names')
+
+# Statements
+
+class LetStatement(Node):
+    "`index` is the array index expression, or None."
+    __slots__ = ('name', 'index', 'value')
+
+class IfStatement(Node):
+    "`else_statements` is None without an else clause."
+    __slots__ = ('condition', 'statements', 'else_statements')
+
+class WhileStatement(Node):
+    __slots__ = ('condition', 'statements')
+
+class DoStatement(Node):
+    __slots__ = ('call',)
+
+class ReturnStatement(Node):
+    __slots__ = ('value',)
+
+# Expressions
+
+class Expression(Node):
+    "terms[0] ops[0] terms[1] ops[1] ..., evaluated left to right."
+    __slots__ = ('terms', 'ops')
+
+class IntegerConstant(Node):
+    __slots__ = ('value',)
+
+class StringConstant(Node):
+    __slots__ = ('value',)
+
+class KeywordConstant(Node):
+    "true, false, null or this."
+    __slots__ = ('value',)
+
+class VarName(Node):
+    __slots__ = ('name',)
+
+class ArrayAccess(Node):
+    __slots__ = ('name', 'index')
+
+class SubroutineCall(Node):
+    "`receiver` is the class or variable name before the dot, or None."
+    __slots__ = ('receiver', 'name', 'arguments')
+
+class ParenExpression(Node):
+    __slots__ = ('expression',)
+
+class UnaryOp(Node):
+    __slots__ = ('op', 'term')
+
+class Visitor:
+    "Dispatches `visit(node)` to the `visit_<NodeClass>` method."
+    def visit(self, node):
+        return getattr(self, 'visit_' + type(node).__name__)(node)
@@ -1,7 +1,184 @@
+"""Compile .jack files, or every .jack file of a directory, to .vm files.
+
+Incremental builds of a directory keep a manifest of each class's source,
+.vm and (with xml) .xml hashes, exported signature (field count and the kind and argument
+count of each subroutine) and the names it references, all taken from
+the syntax tree of its last compilation. A class is recompiled when its
+source or one of its outputs changed, and then the classes referencing
+one whose signature changed are. The outputs of classes removed since the
+last build are deleted.
+"""
+
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import argparse
+import hashlib
+import json
+import sys
+import time
+
+from compilation_engine import CompilationEngine, JackSyntaxError
+from jack_ast import Node, StringConstant
+from xml_writer import XMLWriter
+
+MANIFEST = '.jack_manifest.json'
+# Compiler sources: a change to any of them invalidates the manifest
+COMPILER_FILES = ['compilation_engine.py', 'expression_tree.py', 'jack_ast.py', 'jack_parser.py',
+                  'jack_tokenizer.py', 'symbol_table.py', 'vm_writer.py', 'xml_writer.py']
+
+def compiler_fingerprint(optimize=0, xml=False):
+    h = hashlib.sha256(b'O%d%s' % (optimize, b' xml' if xml else b''))
+    for name in COMPILER_FILES:
+        h.update((Path(__file__).resolve().parent/name).read_bytes())
+    return h.hexdigest()
+
+def source_hash(filename):
+    return hashlib.sha256(Path(filename).read_bytes()).hexdigest()
+
+def output_hash(filename, suffix='.vm'):
+    "The hash of an output file of a source, or None if there is none."
+    try:
+        return source_hash(Path(filename).with_suffix(suffix))
+    except FileNotFoundError:
+        return None
+
+def class_interface(tree):
+    """The signature of a parsed class and the identifiers it references.
+
+    Returns:
+        ({'fields': int, 'subroutines': {name: [kind, nargs]}}, set of identifiers)
+    """
+    fields = sum(len(dec.names) for dec in tree.class_vars if dec.kind == 'field')
+    subroutines = {sub.name: [sub.kind, len(sub.parameters)] for sub in tree.subroutines}
+    return {'fields': fields, 'subroutines': subroutines}, identifiers(tree)
+
+def identifiers(node):
+    "Every identifier of a syntax tree: the types, variables, classes and subroutines named."
+    if isinstance(node, str):
+        return {node} if node.isidentifier() else set()
+    if isinstance(node, (list, tuple)):
+        values = node
+    elif isinstance(node, Node) and not isinstance(node, StringConstant):
+        values = [getattr(node, name) for name in node.__slots__]
+    else:
+        return set()
+    return set().union(*map(identifiers, values))
+
+def compile_file(filename, mmap=False, optimize=0, xml=False):
+    """Compile a .jack file into the .vm file next to it, and with xml
+    the .xml parse tree too, from the same parse. Returns the syntax tree."""
+    c = CompilationEngine(filename, str(filename)[:-4]+'vm', mmap, optimize)
+    c.compile()
+    if xml:
+        with open(str(filename)[:-4]+'xml', 'w') as f:
+            XMLWriter(f).visit(c.tree)
+    return c.tree
+
+def _timed_compile(filename, mmap=False, optimize=0, xml=False):
+    """Compile one file, returning the time taken, any syntax error raised
+    and the `class_interface` of the class, None on an error."""
+    start = time.perf_counter()
+    try:
+        interface = class_interface(compile_file(filename, mmap, optimize, xml))
+        error = None
+    except JackSyntaxError as e:
+        interface, error = None, f'{type(e).__name__}: {e}'
+    return time.perf_counter() - start, error, interface
+
+def _compile_all(filenames, jobs=1, mmap=False, optimize=0, xml=False):
+    "The `_timed_compile` result of each file, in `jobs` processes."
+    if jobs == 1 or not filenames:
+        return [_timed_compile(fn, mmap, optimize, xml) for fn in filenames]
+    with ProcessPoolExecutor(jobs or None) as pool:
+        return list(pool.map(partial(_timed_compile, mmap=mmap, optimize=optimize, xml=xml),
+                             filenames))
+
+def compile_files(filenames, jobs=1, mmap=False, optimize=0, xml=False):
+    """Compile independent files across `jobs` worker processes.
+    A syntax error in one file does not stop the others.
+
+    Returns:
+        list of (filename, seconds, error) tuples in input order, where
+        error is None if the file compiled successfully.
+    """
+    results = _compile_all(filenames, jobs, mmap, optimize, xml)
+    return [(fn, t, err) for fn, (t, err, _) in zip(filenames, results)]
+
+def load_manifest(directory, optimize=0, xml=False):
+    try:
+        with open(Path(directory)/MANIFEST) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+    if manifest.get('compiler') != compiler_fingerprint(optimize, xml):
+        return {}
+    return manifest['classes']
+
+def save_manifest(directory, classes, optimize=0, xml=False):
+    with open(Path(directory)/MANIFEST, 'w') as f:
+        json.dump({'compiler': compiler_fingerprint(optimize, xml), 'xml': xml, 'classes': classes},
+                  f, indent=1, sort_keys=True)
+
+def changed_classes(sources, hashes, old, xml=False):
+    """The classes whose source or outputs changed since the build of
+    the `old` manifest entries, or that it did not compile."""
+    return {name for name, path in sources.items()
+            if name not in old or old[name]['hash'] != hashes[name]
+            or old[name].get('vm') != output_hash(path)
+            or xml and old[name].get('xml') != output_hash(path, '.xml')}
+
+def dependent_classes(classes, old, compiled):
+    """The classes not in `compiled` that reference a class added, removed,
+    failed or compiled to a new signature since the `old` build."""
+    changed = {name for name in compiled | old.keys()
+               if name not in classes or name not in old
+               or classes[name]['signature'] != old[name]['signature']}
+    return {name for name, entry in classes.items()
+            if name not in compiled and changed.intersection(entry['references'])}
+
+def compile_directory(directory, incremental=False, verbose=False, jobs=1, mmap=False, optimize=0,
+                      xml=False):
+    """Compile the .jack files of a directory in `jobs` processes.
+    Incremental compiles the `changed_classes`, then their
+    `dependent_classes`, and removes the .vm files of the classes of the
+    last build that are gone.
+
+    Returns:
+        the (filename, seconds, error) results of `compile_files`.
+    """
+    directory = Path(directory)
+    sources = {f.stem: f for f in sorted(directory.iterdir()) if f.suffix == '.jack'}
+    hashes = {name: source_hash(path) for name, path in sources.items()}
+    old = load_manifest(directory, optimize, xml) if incremental else {}
+    for name in old.keys() - sources.keys():
+        for suffix in ('vm', 'xml'):
+            if suffix in old[name]: (directory/f'{name}.{suffix}').unlink(missing_ok=True)
+    stale = changed_classes(sources, hashes, old, xml) if incremental else set(sources)
+    classes = {name: old[name] for name in sources.keys() - stale}
 
-from compilation_engine import CompilationEngine
+    results = []
+    # The sources of the dependents are unchanged, so their signatures are too
+    for _ in range(2 if incremental else 1):
+        filenames = [sources[name] for name in sorted(stale)]
+        if verbose:
+            for f in filenames: print('Compiling', f)
+        for f, (t, err, interface) in zip(filenames, _compile_all(filenames, jobs, mmap,
+                                                                  optimize, xml)):
+            results.append((f, t, err))
+            if err is None:
+                signature, references = interface
+                classes[f.stem] = {'hash': hashes[f.stem], 'vm': output_hash(f),
+                                   'signature': signature,
+                                   'references': sorted(references - {f.stem})}
+                if xml: classes[f.stem]['xml'] = output_hash(f, '.xml')
+            else:
+                # Failed classes are compiled again on the next build
+                classes.pop(f.stem, None)
+        stale = dependent_classes(classes, old, stale)
+    if incremental:
+        save_manifest(directory, classes, optimize, xml)
+    return sorted(results, key=lambda result: result[0])
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Jack Compiler.')
@@ -9,16 +186,39 @@ if __name__ == '__main__':
                         help='Filename or directory to process.')
     parser.add_argument('--verbose', '-v', action='store_true',
                         help='Print compilation progress.')
+    parser.add_argument('--incremental', '-i', action='store_true',
+                        help=f'Only recompile the classes of a directory that changed, '
+                             f'or depend on a changed interface (tracked in {MANIFEST}).')
+    parser.add_argument('--jobs', '-j', type=int,
+                        help='Compile the files of a directory in N processes (0 for one per '
+                             'core), reporting the time and errors of each file.')
+    parser.add_argument('--mmap', '-m', action='store_true',
+                        help='Memory-map the sources and tokenize them as bytes, '
+                             'for very large generated files.')
+    parser.add_argument('--optimize', '-O', type=int, default=0, choices=[0, 1],
+                        help='1 folds constant expressions and replaces multiplications '
+                             'by constants with additions where possible.')
+    parser.add_argument('--xml', '-x', action='store_true',
+                        help='Also write the XML parse tree of each file, from the same parse.')
     args = parser.parse_args()
 
     path = Path(args.path)
     if path.is_dir():
-        for f in path.iterdir():
-            if f.suffix == '.jack':
-                if args.verbose: print('Compiling', f)
-                c = CompilationEngine(f, str(f)[:-4]+'vm')
-                c.compile()
+        start = time.perf_counter()
+        jobs = 1 if args.jobs is None else args.jobs
+        results = compile_directory(path, args.incremental, args.verbose, jobs, args.mmap,
+                                    args.optimize, args.xml)
+        failed = [(fn, err) for fn, _, err in results if err is not None]
+        if args.jobs is not None:
+            for fn, t, err in results:
+                print(f'{fn}: {t*1000:.1f}ms' + ('' if err is None else ' FAILED'))
+            print(f'Compiled {len(results)-len(failed)}/{len(results)} files '
+                  f'in {time.perf_counter()-start:.2f}s')
+        elif args.incremental and args.verbose:
+            print(f'{len(results)} classes compiled')
+        for fn, err in failed:
+            print(f'{fn}: {err}', file=sys.stderr)
+        if failed: sys.exit(1)
     else:
         if args.verbose: print('Compiling', path)
-        c = CompilationEngine(path, str(path)[:-4]+'vm')
-        c.compile()
+        compile_file(path, args.mmap, args.optimize, args.xml)
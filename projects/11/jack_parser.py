@@ -0,0 +1,248 @@
+"""Recursive-descent parser of a Jack class into a `jack_ast.Class`.
+
+The parser reads the token stream once with a single token of lookahead
+and reports syntax errors as `JackSyntaxError` at the offending token.
+"""
+
+from jack_ast import (ArrayAccess, Class, ClassVarDec, DoStatement, Expression, IfStatement,
+                      IntegerConstant, KeywordConstant, LetStatement, ParenExpression,
+                      ReturnStatement, StringConstant, SubroutineCall, SubroutineDec, UnaryOp,
+                      VarDec, VarName, WhileStatement)
+from jack_tokenizer import JackSyntaxError, JackTokenizer, TokenType
+
+CLASS_VAR_KINDS = {'static', 'field'}
+SUBROUTINE_KINDS = {'constructor', 'function', 'method'}
+TYPE_KEYWORDS = {'int', 'char', 'boolean'}
+KEYWORD_CONSTANTS = {'true', 'false', 'null', 'this'}
+STATEMENTS = {'let', 'if', 'while', 'do', 'return'}
+OPS = set('+-*/&|<>=')
+UNARY_OPS = set('-~')
+
+class JackParser:
+    def __init__(self, filename, mmap=False):
+        self.file = filename
+        self.tokenizer = JackTokenizer(filename, mmap)
+        self._tokens = None
+        self._token = None      # The last token consumed
+        self._next = None       # The lookahead token, None at the end of the file
+
+    def parse(self):
+        "Parse the file's class."
+        self._tokens = iter(self.tokenizer)
+        self._next = next(self._tokens, None)
+        if self._peek() != 'class':
+            self.syntax_error(f'File should begin with `class` but found "{self._found()}"',
+                              self._next)
+        tree = self.parse_class()
+        if self._next is not None:
+            self.syntax_error(f'Expected the end of the file after the class but found '
+                              f'"{self._found()}"', self._next)
+        return tree
+
+    # Token stream
+
+    def _peek(self):
+        """The text of the lookahead token, or None at the end of the file and
+        for string constants, so a string like ")" never matches a symbol."""
+        token = self._next
+        return None if token is None or token.type == TokenType.STRCNST else token.text
+
+    def _found(self):
+        "The lookahead token's text for error messages."
+        return 'end of file' if self._next is None else self._next.text
+
+    def _advance(self):
+        if self._next is None:
+            self.syntax_error('Unexpected end of file')
+        self._token = self._next
+        self._next = next(self._tokens, None)
+        return self._token
+
+    def _expect(self, text):
+        token = self._advance()
+        if token.text != text or token.type == TokenType.STRCNST:
+            self.syntax_error(f'token "{token.text}" should be "{text}"', token)
+        return token
+
+    def _identifier(self):
+        token = self._advance()
+        if token.type != TokenType.IDENTIFIER:
+            self.syntax_error(f'"{token.text}" is not a valid identifier.', token)
+        return token.text
+
+    def _type(self, void=False):
+        token = self._advance()
+        if not (token.type == TokenType.IDENTIFIER or token.text in TYPE_KEYWORDS
+                or void and token.text == 'void'):
+            self.syntax_error(f'"{token.text}" is not a valid type.', token)
+        return token.text
+
+    def _names(self):
+        "name (',' name)* ';'"
+        names = [self._identifier()]
+        while self._peek() == ',':
+            self._advance()
+            names.append(self._identifier())
+        self._expect(';')
+        return names
+
+    # Declarations
+
+    def parse_class(self):
+        offset = self._expect('class').offset
+        name = self._identifier()
+        self._expect('{')
+        class_vars = []
+        while self._peek() in CLASS_VAR_KINDS:
+            token = self._advance()
+            class_vars.append(ClassVarDec(token.text, self._type(), self._names(), offset=token.offset))
+        subroutines = []
+        while self._peek() in SUBROUTINE_KINDS:
+            subroutines.append(self.parse_subroutine())
+        self._expect('}')
+        return Class(name, class_vars, subroutines, offset=offset)
+
+    def parse_subroutine(self):
+        token = self._advance()
+        return_type = self._type(void=True)
+        name = self._identifier()
+        self._expect('(')
+        parameters = []
+        while self._peek() != ')':
+            if parameters: self._expect(',')
+            parameters.append((self._type(), self._identifier()))
+        self._advance()
+        self._expect('{')
+        local_vars = []
+        while self._peek() == 'var':
+            offset = self._advance().offset
+            local_vars.append(VarDec(self._type(), self._names(), offset=offset))
+        statements = self.parse_statements()
+        return SubroutineDec(token.text, return_type, name, parameters, local_vars, statements,
+                             offset=token.offset)
+
+    # Statements
+
+    def parse_statements(self):
+        "statement* '}'"
+        statements = []
+        while self._peek() != '}':
+            keyword = self._peek()
+            if keyword not in STATEMENTS:
+                self.syntax_error(f'Expected statement but found "{self._found()}"', self._next)
+            statements.append(getattr(self, 'parse_' + keyword)())
+        self._advance()
+        return statements
+
+    def parse_let(self):
+        offset = self._advance().offset
+        name = self._identifier()
+        index = None
+        if self._peek() == '[':
+            self._advance()
+            index = self.parse_expression(']')
+        self._expect('=')
+        return LetStatement(name, index, self.parse_expression(';'), offset=offset)
+
+    def parse_if(self):
+        offset = self._advance().offset
+        self._expect('(')
+        condition = self.parse_expression(')')
+        self._expect('{')
+        statements = self.parse_statements()
+        else_statements = None
+        if self._peek() == 'else':
+            self._advance()
+            self._expect('{')
+            else_statements = self.parse_statements()
+        return IfStatement(condition, statements, else_statements, offset=offset)
+
+    def parse_while(self):
+        offset = self._advance().offset
+        self._expect('(')
+        condition = self.parse_expression(')')
+        self._expect('{')
+        return WhileStatement(condition, self.parse_statements(), offset=offset)
+
+    def parse_do(self):
+        offset = self._advance().offset
+        token = self._advance()
+        if token.type != TokenType.IDENTIFIER and token.text != 'this':
+            self.syntax_error(f'"{token.text}" is not a valid identifier.', token)
+        call = self.parse_call(token)
+        self._expect(';')
+        return DoStatement(call, offset=offset)
+
+    def parse_return(self):
+        offset = self._advance().offset
+        if self._peek() == ';':
+            self._advance()
+            return ReturnStatement(None, offset=offset)
+        return ReturnStatement(self.parse_expression(';'), offset=offset)
+
+    # Expressions
+
+    def parse_expression(self, end):
+        "term (op term)* followed by one of the `end` symbols, which is consumed."
+        offset = None if self._next is None else self._next.offset
+        terms = [self.parse_term()]
+        ops = []
+        while self._peek() in OPS:
+            ops.append(self._advance().text)
+            terms.append(self.parse_term())
+        token = self._advance()
+        if token.type != TokenType.SYMBOL or token.text not in end:
+            expected = '" or "'.join(end)
+            self.syntax_error(f'token "{token.text}" should be "{expected}"', token)
+        return Expression(terms, ops, offset=offset)
+
+    def parse_term(self):
+        token = self._advance()
+        text, token_type, offset = token.text, token.type, token.offset
+        if token_type == TokenType.INTCNST:
+            return IntegerConstant(int(text), offset=offset)
+        if token_type == TokenType.STRCNST:
+            return StringConstant(text, offset=offset)
+        if token_type == TokenType.KEYWORD and text in KEYWORD_CONSTANTS:
+            if text == 'this' and self._peek() == '.':
+                return self.parse_call(token)
+            return KeywordConstant(text, offset=offset)
+        if token_type == TokenType.SYMBOL:
+            if text == '(':
+                return ParenExpression(self.parse_expression(')'), offset=offset)
+            if text in UNARY_OPS:
+                return UnaryOp(text, self.parse_term(), offset=offset)
+        if token_type == TokenType.IDENTIFIER:
+            if self._peek() == '[':
+                self._advance()
+                return ArrayAccess(text, self.parse_expression(']'), offset=offset)
+            if self._peek() in ('(', '.'):
+                return self.parse_call(token)
+            return VarName(text, offset=offset)
+        self.syntax_error(f'Expected expression but found "{text}"', token)
+
+    def parse_call(self, token):
+        "The rest of a subroutine call starting with `token`."
+        receiver, name = None, token.text
+        if self._peek() == '.':
+            self._advance()
+            receiver, name = name, self._identifier()
+        self._expect('(')
+        arguments = []
+        if self._peek() == ')':
+            self._advance()
+        else:
+            while self._token.text != ')':
+                arguments.append(self.parse_expression(',)'))
+        return SubroutineCall(receiver, name, arguments, offset=token.offset)
+
+    # Errors
+
+    def position(self, offset):
+        return self.tokenizer.position(offset)
+
+    def syntax_error(self, error, token=None):
+        "Raise a JackSyntaxError at `token`, by default the last token consumed."
+        token = token or self._token
+        line, column = (1, 1) if token is None else self.position(token.offset)
+        raise JackSyntaxError(f'{self.file}:{line}:{column}: {error}', line, column)
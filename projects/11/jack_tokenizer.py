@@ -1,7 +1,31 @@
-"Tokenize jack files into tokens and token types."
+"""Tokenize jack files into tokens and token types.
+
+The whole file is matched by a single regex with one named group per
+token class, so the group that matched classifies the token. Whitespace
+and comments are skipped by the prefix of each match; as every comment
+starts with a '/' and some alternative always matches after the prefix,
+including the end of the file, the prefix never has to backtrack. Tokens
+keep their offset in the file, which `JackTokenizer.position` turns
+into a line and column for the `JackSyntaxError` raised on a character
+that starts no token or an unterminated comment.
+
+With `mmap=True` the file is memory-mapped and scanned as bytes instead
+of being read into a string: keywords and symbols map to their shared
+str, only identifiers, integers and strings are decoded, and offsets are
+byte offsets. Memory use then stays flat however large the file is.
+"""
 
 from enum import Enum
+import mmap as _mmap
+import os
 import re
+import sys
+
+class JackSyntaxError(Exception):
+    def __init__(self, message, line=None, column=None):
+        super().__init__(message)
+        self.line = line
+        self.column = column
 
 class TokenType(Enum):
     KEYWORD = 'keyword'
@@ -10,59 +34,100 @@ class TokenType(Enum):
     STRCNST = 'stringConstant'
     IDENTIFIER = 'identifier'
 
+KEYWORDS = ('class', 'constructor', 'function', 'method', 'field', 'static', 'var',
+            'int', 'char', 'boolean', 'void', 'true', 'false', 'null', 'this',
+            'let', 'do', 'if', 'else', 'while', 'return')
+
+TOKENS = re.compile(r'''\s*(?:(?://[^\n]*|/\*.*?\*/)\s*)*(?:
+      (?P<end>\Z)
+    | (?P<unterminated>/\*)
+    | (?P<keyword>(?:''' + '|'.join(KEYWORDS) + r''')\b)
+    | (?P<identifier>[A-Za-z_]\w*)
+    | (?P<symbol>[{}()[\].,;+\-*/&|<>=~])
+    | "(?P<string>[^"\n]*)"
+    | (?P<integer>\d+)\b
+    | (?P<error>\S\w*)
+    )''', re.S | re.X | re.A)
+BYTE_TOKENS = re.compile(TOKENS.pattern.encode(), TOKENS.flags & ~re.U)
+
+token_types = {
+    'keyword': TokenType.KEYWORD, 'symbol': TokenType.SYMBOL,
+    'integer': TokenType.INTCNST, 'string': TokenType.STRCNST,
+    'identifier': TokenType.IDENTIFIER,
+}
+# The text of keywords and symbols, which are never decoded in mmap mode
+fixed_tokens = {t.encode(): t for t in KEYWORDS + tuple('{}()[].,;+-*/&|<>=~')}
+
+class Token:
+    """A token's interned text, TokenType and offset in the source.
+    Unpacks as (text, type)."""
+    __slots__ = ('text', 'type', 'offset')
+
+    def __init__(self, text, type, offset):
+        self.text = text
+        self.type = type
+        self.offset = offset
+
+    def __iter__(self):
+        return iter((self.text, self.type))
+
+    def __repr__(self):
+        return f'Token({self.text!r}, {self.type}, {self.offset})'
+
 class JackTokenizer:
-    def __init__(self, filename):
+    def __init__(self, filename, mmap=False):
         self.file = filename
-        self.symbols = set('{}()[].,;+-*/&|<>=~')
-        self.keywords = {'class', 'constructor', 'function', 'method',
-                        'field', 'static', 'var', 'int', 'char', 'boolean',
-                        'void', 'true', 'false', 'null', 'this', 'let', 'do',
-                        'if', 'else', 'while', 'return'}
-        self.identifiers = set('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_')
-        self.splits = re.compile('"[^"]*"|\w+|[{}()[\].,;+\-*\/&|<>=~]')
-        self.comments = re.compile('//|/\*')
+        self.mmap = mmap
+        self.text = None
 
     def __iter__(self):
-        for line in self.get_lines():
-            for token in self.splits.findall(line):
-                token_type = self.get_token_type(token)
-                if token_type == TokenType.STRCNST: token = token[1:-1]
-                yield token, token_type
-
-    def get_token_type(self, token):
-        if token in self.symbols:
-            return TokenType.SYMBOL
-        if token in self.keywords:
-            return TokenType.KEYWORD
-        if token[0] == '"' and token[-1] == '"':
-            return TokenType.STRCNST
-        if token.isdigit():
-            return TokenType.INTCNST
-        if set(token).issubset(self.identifiers) and not token[0].isdigit():
-            return TokenType.IDENTIFIER
-        raise ValueError('Token %s not recognized.' % token)
-
-    def get_lines(self):
-        "Generate stripped code lines from a text file."
+        if self.mmap:
+            yield from self._iter_mmap()
+            return
         with open(self.file, 'r') as f:
-            block_comment=False
-            for line in f:
-                line = line[:-1]
-                if block_comment:
-                    if re.search('\*/', line) is not None:
-                        block_comment = False
-                    continue
-                comment = self.comments.search(line)
-                if comment is not None:
-                    start = comment.start()
-                    if comment.group() == '/*':
-                        if re.search("\*/", line[start+2:]) is None:
-                            block_comment = True
-                        continue
+            self.text = text = f.read()
+        types, intern = token_types, sys.intern
+        for match in TOKENS.finditer(text):
+            group = match.lastgroup
+            if group == 'end': return
+            if group == 'error' or group == 'unterminated':
+                self._error(group, match[group], match.start(group))
+            yield Token(intern(match[group]), types[group], match.start(group))
+
+    def _iter_mmap(self):
+        types, intern, fixed = token_types, sys.intern, fixed_tokens
+        with open(self.file, 'rb') as f:
+            if not os.fstat(f.fileno()).st_size: return   # Empty files can't be mapped
+            data = _mmap.mmap(f.fileno(), 0, access=_mmap.ACCESS_READ)
+        with data:
+            matches, match = BYTE_TOKENS.finditer(data), None
+            try:
+                for match in matches:
+                    group = match.lastgroup
+                    if group == 'keyword' or group == 'symbol':
+                        text = fixed[match[group]]
+                    elif group == 'end':
+                        return
+                    elif group == 'error' or group == 'unterminated':
+                        self._error(group, match[group].decode(errors='replace'),
+                                    match.start(group))
                     else:
-                        line = line[:start].strip()
-                        if len(line)>0:
-                            yield line
-                elif not block_comment:
-                    if len(line)>0:
-                        yield line.strip()
+                        text = intern(match[group].decode())
+                    yield Token(text, types[group], match.start(group))
+            finally:
+                # The scanner holds a buffer export that would keep the map from closing
+                del matches, match
+
+    def _error(self, group, token, offset):
+        line, column = self.position(offset)
+        message = 'Unterminated comment.' if group == 'unterminated' else f'Token {token} not recognized.'
+        raise JackSyntaxError(f'{self.file}:{line}:{column}: {message}', line, column)
+
+    def position(self, offset):
+        "The 1-based (line, column) of an offset in the file."
+        text = self.text
+        if text is None:
+            with open(self.file, 'rb') as f:
+                text = f.read(offset).decode(errors='replace')
+        line = text.count('\n', 0, offset) + 1
+        return line, offset - text.rfind('\n', 0, offset)
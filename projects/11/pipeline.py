@@ -0,0 +1,164 @@
+"""Build Jack programs into a Hack image in memory.
+
+Each stage normally writes a file for the next one to read back: the
+compiler writes .vm, the translator re-reads it with `get_lines` and
+writes .asm, and the assembler re-reads that with `remove_comments`.
+The pipeline hands the VM command tuples of each `CompilationEngine`
+straight to the translator, and streams the translated assembly into
+the single pass assembler, so only the final image is written (and the
+.vm and .asm intermediates when asked for).
+"""
+
+from pathlib import Path
+import sys
+
+from compilation_engine import CompilationEngine
+
+sys.path.append(str(Path(__file__).resolve().parent.parent/'08'))
+from translator import link, read_commands, translate_program
+sys.path.append(str(Path(__file__).resolve().parent.parent/'06'))
+from assembler import assemble_stream, output_formats
+
+def source_files(paths):
+    """The .jack and .vm files of `paths`, files or directories. A class
+    found more than once is taken from its first path, and from its .jack
+    file over a .vm file, so a program can replace classes of the OS."""
+    files = {}
+    for p in map(Path, paths):
+        found = sorted(f for f in p.iterdir() if f.suffix in ('.jack', '.vm')) if p.is_dir() else [p]
+        for f in found:
+            files.setdefault(f.stem, f)
+    return list(files.values())
+
+def asm_lines(blocks):
+    "Split blocks of generated asm into the cleaned lines the assembler reads."
+    for block in blocks:
+        for line in block.split('\n'):
+            line = line.split('//')[0].replace(' ', '')
+            if line: yield line
+
+class Pipeline:
+    """Compile, translate and assemble a program without intermediate files.
+
+    Attributes:
+        program (list): (filename, VM commands) pairs, one per class.
+        removed (list): the functions dropped by link_functions.
+        asm (list): the cleaned asm lines, kept only with keep_asm.
+        words (array): the instruction words of the image.
+    """
+    def __init__(self, optimize=0, vm_optimize=False, shared_calls=False, intrinsics=False,
+                 bootstrap=True, keep_asm=False, shared_compares=False, stack_cache=False,
+                 link_functions=False):
+        self.optimize = optimize
+        self.vm_optimize = vm_optimize
+        self.shared_calls = shared_calls
+        self.intrinsics = intrinsics
+        self.bootstrap = bootstrap
+        self.keep_asm = keep_asm
+        self.shared_compares = shared_compares
+        self.stack_cache = stack_cache
+        self.link_functions = link_functions
+        self.program = []
+        self.removed = []
+        self.asm = None
+        self.words = None
+
+    def compile(self, paths):
+        "Compile the .jack files of `paths`, and read its .vm files, into `program`."
+        self.program = []
+        for f in source_files(paths):
+            if f.suffix == '.jack':
+                engine = CompilationEngine(str(f), optimize=self.optimize)
+                engine.compile()
+                commands = engine.writer.commands
+            else:
+                commands = read_commands(f)
+            self.program.append((str(f), commands))
+        return self.program
+
+    def assemble(self):
+        "Translate `program` and assemble it into `words`."
+        if self.link_functions:
+            self.program, self.removed = link(self.program)
+        blocks = translate_program(self.program, bootstrap=self.bootstrap,
+                                   optimize=self.vm_optimize, shared_calls=self.shared_calls,
+                                   intrinsics=self.intrinsics, verbose=False,
+                                   shared_compares=self.shared_compares,
+                                   stack_cache=self.stack_cache)
+        lines = asm_lines(blocks)
+        if self.keep_asm:
+            self.asm = lines = list(lines)
+        self.words = assemble_stream(lines)
+        return self.words
+
+    def build(self, paths):
+        "Build the program of `paths` into its image."
+        self.compile(paths)
+        return self.assemble()
+
+    def write(self, filename, fmt='hack'):
+        "Write the image to `filename` in one of the assembler's output formats."
+        _, mode, write = output_formats[fmt]
+        with open(filename, mode) as f:
+            write(self.words, f)
+
+    def write_intermediates(self, directory, name):
+        "Write the .vm file of each class and the program's `name`.asm to `directory`."
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for f, commands in self.program:
+            text = ''.join(' '.join(words) + '\n' for words in commands)
+            (directory/(Path(f).stem+'.vm')).write_text(text)
+        if self.asm is not None:
+            (directory/(name+'.asm')).write_text('\n'.join(self.asm) + '\n')
+
+if __name__=='__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Build Jack programs into a Hack image in memory.')
+    parser.add_argument('path', type=str, nargs='+',
+                        help='.jack/.vm files or directories of the program (and OS).')
+    parser.add_argument('--output', '-o', type=str,
+                        help='Filename of the image.')
+    parser.add_argument('--format', '-f', type=str, default='hack',
+                        choices=list(output_formats),
+                        help='Output format: .hack text or a little/big endian binary image.')
+    parser.add_argument('--optimize', '-O', type=int, default=0, choices=[0, 1],
+                        help='Jack optimization level: 1 folds constant expressions.')
+    parser.add_argument('--vm-optimize', action='store_true',
+                        help='Optimize the translated asm.')
+    parser.add_argument('--shared-calls', action='store_true',
+                        help='Use shared call/return routines to reduce code size.')
+    parser.add_argument('--intrinsics', action='store_true',
+                        help='Replace calls to hot OS functions with assembly routines.')
+    parser.add_argument('--shared-compares', action='store_true',
+                        help='Use shared eq/gt/lt routines to reduce code size.')
+    parser.add_argument('--stack-cache', action='store_true',
+                        help='Keep the top of the stack in the D register.')
+    parser.add_argument('--link', action='store_true',
+                        help='Drop the functions Sys.init never calls, directly or not.')
+    parser.add_argument('--no-bootstrap', action='store_true',
+                        help='Do not emit the bootstrap code that calls Sys.init.')
+    parser.add_argument('--intermediates', '-i', type=str,
+                        help='Also write the .vm and .asm files to this directory, for debugging.')
+
+    args = parser.parse_args()
+    p0 = Path(args.path[0])
+    name = p0.name if p0.is_dir() else p0.stem
+    if args.output is None:
+        args.output = str((p0 if p0.is_dir() else p0.parent)/name) + output_formats[args.format][0]
+
+    start = time.perf_counter()
+    pipeline = Pipeline(args.optimize, args.vm_optimize, args.shared_calls, args.intrinsics,
+                        not args.no_bootstrap, keep_asm=args.intermediates is not None,
+                        shared_compares=args.shared_compares, stack_cache=args.stack_cache,
+                        link_functions=args.link)
+    pipeline.build(args.path)
+    pipeline.write(args.output, args.format)
+    if args.intermediates is not None:
+        pipeline.write_intermediates(args.intermediates, name)
+    if pipeline.removed:
+        print(f'Removed {len(pipeline.removed)} unreachable functions: {", ".join(pipeline.removed)}')
+    print(f'Built {args.output}: {len(pipeline.program)} classes, '
+          f'{len(pipeline.words)} instructions in {time.perf_counter()-start:.2f}s')
@@ -0,0 +1,357 @@
+from pathlib import Path
+import shutil
+import sys
+import tempfile
+
+from compilation_engine import CompilationEngine, JackSyntaxError
+from jack_ast import (Expression, IntegerConstant, LetStatement, StringConstant, SubroutineCall,
+                      UnaryOp, VarName)
+from jack_compiler import class_interface, compile_directory, compile_file, compile_files
+from jack_parser import JackParser
+from jack_tokenizer import JackTokenizer, TokenType
+from pipeline import Pipeline
+
+sys.path.append(str(Path(__file__).resolve().parent.parent/'08'))
+from translator import translator
+from vm_interpreter import VMInterpreter, VMProgram, vm_files
+sys.path.append(str(Path(__file__).resolve().parent.parent/'06'))
+from assembler import assemble, remove_comments
+
+
+def test_tokenizer():
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp)/'Main.jack'
+        source.write_text('/** doc\n comment */ class Main { // line\n'
+                          'do Output.printString("a // b"); let classic=x/2; }')
+        tokenizer = JackTokenizer(source)
+        tokens = list(tokenizer)
+        assert [tuple(t) for t in tokens] == [
+            ('class', TokenType.KEYWORD), ('Main', TokenType.IDENTIFIER), ('{', TokenType.SYMBOL),
+            ('do', TokenType.KEYWORD), ('Output', TokenType.IDENTIFIER), ('.', TokenType.SYMBOL),
+            ('printString', TokenType.IDENTIFIER), ('(', TokenType.SYMBOL),
+            ('a // b', TokenType.STRCNST), (')', TokenType.SYMBOL), (';', TokenType.SYMBOL),
+            ('let', TokenType.KEYWORD), ('classic', TokenType.IDENTIFIER), ('=', TokenType.SYMBOL),
+            ('x', TokenType.IDENTIFIER), ('/', TokenType.SYMBOL), ('2', TokenType.INTCNST),
+            (';', TokenType.SYMBOL), ('}', TokenType.SYMBOL)]
+        assert tokenizer.position(0) == (1, 1) and tokenizer.position(tokens[3].offset) == (3, 1)
+        text = source.read_text()
+        assert [t.offset for t in tokens[:3]] == [text.index('class'), text.index('Main'), text.index('{')]
+        assert tokens[0].text is tokens[0].text == 'class'
+
+        source.write_text('class Main { let x = 1#; }')
+        try:
+            list(JackTokenizer(source))
+            assert False, 'Expected an error'
+        except JackSyntaxError as e:
+            assert '#' in str(e) and ':1:23:' in str(e)
+
+
+def test_tokenizer_file_end():
+    "Comments and whitespace at the end of the file are skipped in both modes."
+    body = 'class Main {\n}\n'
+    tokens = [('class', TokenType.KEYWORD), ('Main', TokenType.IDENTIFIER),
+              ('{', TokenType.SYMBOL), ('}', TokenType.SYMBOL)]
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp)/'Main.jack'
+        for end in ["// see 'Main'", '/* done */', '// note\n', ' \t\n'*40]:
+            source.write_text(body + end)
+            for mmap in (False, True):
+                assert [tuple(t) for t in JackTokenizer(source, mmap)] == tokens, (end, mmap)
+
+        source.write_text(body + '/* never closed\n')
+        for mmap in (False, True):
+            try:
+                list(JackTokenizer(source, mmap))
+                assert False, 'Expected an error'
+            except JackSyntaxError as e:
+                assert ':3:1: Unterminated comment' in str(e)
+
+
+def test_tokenizer_mmap():
+    for f in sorted(Path('.').rglob('*.jack')):
+        text, mapped = list(JackTokenizer(f)), list(JackTokenizer(f, mmap=True))
+        assert [tuple(t) for t in mapped] == [tuple(t) for t in text]
+        if b'\r' not in f.read_bytes():
+            assert [t.offset for t in mapped] == [t.offset for t in text]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp)/'Main.jack'
+        source.write_text('')
+        assert list(JackTokenizer(source, mmap=True)) == []
+        source.write_text('class Main {\n  let s = "caf\u00e9"#; }')
+        try:
+            list(JackTokenizer(source, mmap=True))
+            assert False, 'Expected an error'
+        except JackSyntaxError as e:
+            assert ':2:18:' in str(e)
+
+
+def test_syntax_error_position():
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp)/'Main.jack'
+        source.write_text('class Main {\n  function void f() {\n    var int x;\n    let x 1;\n  }\n}\n')
+        try:
+            CompilationEngine(source, Path(tmp)/'Main.vm').compile()
+            assert False, 'Expected an error'
+        except JackSyntaxError as e:
+            assert (e.line, e.column) == (4, 11)
+            assert str(e).startswith(f'{source}:4:11: ')
+
+        source.write_text('class Main {\n  function void f() {\n    return')
+        try:
+            CompilationEngine(source, Path(tmp)/'Main.vm').compile()
+            assert False, 'Expected an error'
+        except JackSyntaxError as e:
+            assert 'end of file' in str(e) and e.line == 3
+
+
+def test_class_interface():
+    signature, references = class_interface(JackParser('Pong/Bat.jack').parse())
+    assert signature['fields'] == 5
+    assert signature['subroutines']['new'] == ['constructor', 4]
+    assert signature['subroutines']['setDirection'] == ['method', 1]
+    assert 'Screen' in references
+
+
+def test_incremental():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for f in Path('Pong').glob('*.jack'):
+            shutil.copy(f, tmp)
+        names = lambda results: sorted(f.stem for f, _, _ in results)
+
+        assert names(compile_directory(tmp, incremental=True)) == ['Ball', 'Bat', 'Main', 'PongGame']
+        full = {f.name: f.read_text() for f in tmp.glob('*.vm')}
+        assert compile_directory(tmp, incremental=True) == []
+
+        # A change that keeps the interface only recompiles the class
+        bat = (tmp/'Bat.jack').read_text()
+        (tmp/'Bat.jack').write_text(bat + '\n// comment\n')
+        assert names(compile_directory(tmp, incremental=True)) == ['Bat']
+
+        # A new signature recompiles the classes referencing it
+        (tmp/'Bat.jack').write_text(bat.replace('method void dispose()', 'method void dispose(int x)'))
+        assert names(compile_directory(tmp, incremental=True)) == ['Bat', 'PongGame']
+
+        # Missing outputs are rebuilt
+        (tmp/'Bat.jack').write_text(bat)
+        (tmp/'Ball.vm').unlink()
+        assert names(compile_directory(tmp, incremental=True)) == ['Ball', 'Bat', 'PongGame']
+        assert {f.name: f.read_text() for f in tmp.glob('*.vm')} == full
+
+        # Edited outputs are rebuilt
+        (tmp/'Ball.vm').write_text('// edited\n')
+        assert names(compile_directory(tmp, incremental=True)) == ['Ball']
+        assert (tmp/'Ball.vm').read_text() == full['Ball.vm']
+
+        # The outputs of removed classes are deleted, and their users recompiled
+        (tmp/'Bat.jack').unlink()
+        assert names(compile_directory(tmp, incremental=True)) == ['PongGame']
+        assert not (tmp/'Bat.vm').exists()
+
+        # A class that does not compile is reported, and retried on the next build
+        (tmp/'Ball.jack').write_text('class Ball {\n  field int x#;\n')
+        results = compile_directory(tmp, incremental=True)
+        assert [(f.stem, err is None) for f, _, err in results] == [('Ball', False), ('PongGame', True)]
+        assert ':2:14: Token # not recognized' in results[0][2]
+        (tmp/'Ball.jack').write_text('class Ball {\n  field int x;\n')
+        results = compile_directory(tmp, incremental=True)
+        assert names(results) == ['Ball', 'PongGame'] and 'end of file' in results[0][2]
+
+
+
+def test_incremental_xml():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for f in Path('Square').glob('*.jack'):
+            shutil.copy(f, tmp)
+        names = lambda results: sorted(f.stem for f, _, _ in results)
+        assert len(compile_directory(tmp, incremental=True)) == 3
+        assert list(tmp.glob('*.xml')) == []
+
+        # Asking for the parse trees rebuilds every class once
+        assert len(compile_directory(tmp, incremental=True, xml=True)) == 3
+        assert sorted(f.stem for f in tmp.glob('*.xml')) == ['Main', 'Square', 'SquareGame']
+        assert compile_directory(tmp, incremental=True, xml=True) == []
+
+        # Missing parse trees are rebuilt, and those of removed classes deleted
+        (tmp/'Square.xml').unlink()
+        assert names(compile_directory(tmp, incremental=True, xml=True)) == ['Square']
+        (tmp/'Main.jack').unlink()
+        compile_directory(tmp, incremental=True, xml=True)
+        assert not (tmp/'Main.xml').exists() and not (tmp/'Main.vm').exists()
+
+def test_compile_files():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for f in Path('Square').glob('*.jack'):
+            shutil.copy(f, tmp)
+        (tmp/'Broken.jack').write_text('class Broken {\n function int f() { let x = 1; return x; }\n}\n')
+        (tmp/'Wrong.jack').write_text('function void f() {}\n')
+        (tmp/'Lexical.jack').write_text('class Lexical {\n  function int f() { return 1 # 2; }\n}\n')
+        filenames = sorted(tmp.glob('*.jack'))
+
+        results = compile_files(filenames, jobs=2)
+        assert [fn for fn, _, _ in results] == filenames
+        errors = {fn.stem: err for fn, _, err in results if err is not None}
+        assert sorted(errors) == ['Broken', 'Lexical', 'Wrong']
+        assert all(err.startswith('JackSyntaxError') for err in errors.values())
+        assert ':2:31: Token # not recognized' in errors['Lexical']
+        assert (tmp/'SquareGame.vm').exists()
+
+        serial = compile_files(filenames)
+        assert [(fn, err) for fn, _, err in serial] == [(fn, err) for fn, _, err in results]
+
+
+def test_parser():
+    with tempfile.TemporaryDirectory() as tmp:
+        source = Path(tmp)/'Main.jack'
+        source.write_text('class Main { function void f() { var int x;\n'
+                          'let x = -x + Output.g(1, x); return; } }')
+        tree = JackParser(source).parse()
+        assert tree.subroutines[0].statements[0] == LetStatement('x', None, Expression(
+            [UnaryOp('-', VarName('x')),
+             SubroutineCall('Output', 'g', [Expression([IntegerConstant(1)], []),
+                                            Expression([VarName('x')], [])])],
+            ['+']))
+        assert tree.subroutines[0].statements[0].offset == source.read_text().index('let')
+
+        source.write_text('class Main { function void f() { let x = 1 2; } }')
+        try:
+            JackParser(source).parse()
+            assert False, 'Expected an error'
+        except JackSyntaxError as e:
+            assert (e.line, e.column) == (1, 44)
+
+        source.write_text('class Main {\n}\nclass Other {\n}\n')
+        try:
+            JackParser(source).parse()
+            assert False, 'Expected an error'
+        except JackSyntaxError as e:
+            assert (e.line, e.column) == (3, 1) and '"class"' in str(e)
+
+        # String constants are never taken for the symbols they spell
+        source.write_text('class Main { function void f() { var String s;\n'
+                          'do Output.printString(")"); let s = "}"; let s = "+";\n'
+                          'if (s) { return ";"; } return; } }')
+        statements = JackParser(source).parse().subroutines[0].statements
+        assert [type(s).__name__ for s in statements] == [
+            'DoStatement', 'LetStatement', 'LetStatement', 'IfStatement', 'ReturnStatement']
+        assert statements[0].call.arguments[0].terms == [StringConstant(')')]
+        assert statements[1].value == Expression([StringConstant('}')], [])
+        assert statements[2].value == Expression([StringConstant('+')], [])
+        assert statements[3].statements[0].value == Expression([StringConstant(';')], [])
+
+
+def test_xml():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        for f in Path('../10/Square').glob('*.jack'):
+            shutil.copy(f, tmp)
+            compile_file(tmp/f.name, xml=True)
+            assert (tmp/f.name).with_suffix('.xml').read_text() == f.with_suffix('.xml').read_text()
+            assert (tmp/f.name).with_suffix('.vm').exists()
+
+
+def test_vm_writer():
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        shutil.copy('Seven/Main.jack', tmp)
+        compile_file(tmp/'Main.jack')
+        c = CompilationEngine(tmp/'Main.jack')
+        c.compile()
+        assert c.writer.text() == (tmp/'Main.vm').read_text()
+        assert c.writer.commands[:2] == [('function', 'Main.main', '0'), ('push', 'constant', '1')]
+
+        # Nothing is written when compilation fails
+        (tmp/'Main.vm').unlink()
+        (tmp/'Main.jack').write_text('class Main { function int f() { let x = 1; return x; } }')
+        try:
+            compile_file(tmp/'Main.jack')
+            assert False, 'Expected an error'
+        except JackSyntaxError:
+            pass
+        assert not (tmp/'Main.vm').exists()
+
+
+OPTIMIZE_CASES = [
+    ('5 + 3', 8), ('-1', -1), ('x * 2', 14), ('x * 8', 56), ('y * 4', -12),
+    ('4 * Main.id(y)', -12), ('x * 0', 0), ('Main.id(x) * 0', 0), ('x / 1', 7),
+    ('(x + 1) + 2', 10), ('x - 1 - 2', 4), ('100 / -7', -14), ('7 * 6', 42),
+    ('~0', -1), ('(3 < 5) | (2 = 3)', -1), ('x * -1', -7), ('0 - x', -7),
+    ('-(-x)', 7), ('x * 2 * 4', 56), ('1000 * 1000', 16960), ('x + (-2)', 5),
+    ('x & true', 7), ('(x * 3) / 2', 10), ('-x * 16384', 16384),
+    ('x * 10', 70), ('y * -6', 18), ('Main.id(x) * 5', 35), ('x * 1000', 7000),
+]
+
+def test_optimize():
+    statements = ''.join(f'let r[{i}] = {expr};\n' for i, (expr, _) in enumerate(OPTIMIZE_CASES))
+    main = ('class Main {\n function int id(int x) { return x; }\n'
+            ' function void main() {\n var int x, y; var Array r;\n'
+            ' let r = 8000; let x = 7; let y = -3;\n' + statements + 'return; }\n}\n')
+    calls = []
+    for optimize in (0, 1):
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            for f in Path('../12').glob('*.jack'):
+                shutil.copy(f, tmp)
+            (tmp/'Main.jack').write_text(main)
+            assert all(err is None for _, _, err in compile_directory(tmp, optimize=optimize))
+            calls.append((tmp/'Main.vm').read_text().count('call Math.'))
+
+            vm = VMInterpreter(VMProgram(vm_files([tmp])))
+            vm.bootstrap()
+            vm.run(10**7)
+            assert vm.halted
+            results = [v - 65536 if v & 0x8000 else v for v in vm.ram[8000:8000+len(OPTIMIZE_CASES)]]
+            assert results == [value for _, value in OPTIMIZE_CASES], optimize
+    # Left: Main.id(x) * 0, x * 1000 and the division of (x * 3) / 2
+    assert calls == [20, 3]
+
+    # Division by zero is left to Math.divide
+    with tempfile.TemporaryDirectory() as tmp:
+        (Path(tmp)/'Main.jack').write_text('class Main { function int f() { return 1 / 0; } }')
+        compile_directory(tmp, optimize=1)
+        assert 'call Math.divide 2' in (Path(tmp)/'Main.vm').read_text()
+
+
+def test_pipeline():
+    "The in-memory build matches the .vm -> .asm -> .hack build."
+    # Without shared calls or optimizations the OS does not fit in ROM
+    for optimize, vm_optimize, shared_calls, intrinsics in [(0, False, True, False),
+                                                             (1, True, False, True)]:
+        pipeline = Pipeline(optimize, vm_optimize, shared_calls, intrinsics, keep_asm=True)
+        words = pipeline.build(['ConvertToBin', '../12'])
+        with tempfile.TemporaryDirectory() as tmp:
+            pipeline.write_intermediates(tmp, 'ConvertToBin')
+            vm = [f for f in sorted(Path(tmp).iterdir()) if f.suffix == '.vm']
+            assert [f.stem for f in vm] == sorted(Path(f).stem for f, _ in pipeline.program)
+            files = [Path(tmp)/(Path(f).stem+'.vm') for f, _ in pipeline.program]
+            with open(Path(tmp)/'Program.asm', 'w') as fout:
+                translator(files, fout, optimize=vm_optimize, shared_calls=shared_calls,
+                           intrinsics=intrinsics)
+            with open(Path(tmp)/'Program.asm') as fin:
+                assert list(words) == assemble(remove_comments(fin))
+            with open(Path(tmp)/'ConvertToBin.asm') as fin:
+                assert list(remove_comments(fin)) == pipeline.asm
+
+    linked = Pipeline(shared_calls=True, link_functions=True)
+    linked.build(['ConvertToBin', '../12'])
+    assert 'Math.sqrt' in linked.removed and 'Main.convert' not in linked.removed
+    assert len(linked.words) < len(Pipeline(shared_calls=True).build(['ConvertToBin', '../12']))
+
+
+if __name__ == '__main__':
+    test_tokenizer()
+    test_tokenizer_file_end()
+    test_tokenizer_mmap()
+    test_syntax_error_position()
+    test_parser()
+    test_xml()
+    test_vm_writer()
+    test_class_interface()
+    test_incremental()
+    test_incremental_xml()
+    test_compile_files()
+    test_optimize()
+    test_pipeline()
@@ -1,44 +1,71 @@
-"Writes commands in the Jack->Hack VM language."
+"""Writes commands in the Jack->Hack VM language.
+
+Commands are buffered as tuples of words, e.g. ('push', 'constant', '7'),
+the way the translator splits VM lines. With a filename they are written
+in one call on `close` or when a `with` block exits without an error;
+with None they stay in memory, as tuples in `commands` or as VM code
+from `text()`, for the translator or interpreter to use directly.
+"""
+
+from contextlib import contextmanager
 
 class VMWriter:
-    def __init__(self, filename):
-        self.file = open(filename, 'w')
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.commands = []
+        self.closed = False
 
     def write_push(self, segment, index):
-        self.write(f'push {segment} {index}')
+        self.write('push', segment, str(index))
 
     def write_pop(self, segment, index):
-        self.write(f'pop {segment} {index}')
+        self.write('pop', segment, str(index))
 
     def write_arithmetic(self, command):
-        self.write(f'{command}')
+        self.write(command)
 
     def write_label(self, label):
-        self.write(f'label {label}')
+        self.write('label', label)
 
     def write_goto(self, label):
-        self.write(f'goto {label}')
+        self.write('goto', label)
 
     def write_if(self, label):
-        self.write(f'if-goto {label}')
+        self.write('if-goto', label)
 
     def write_call(self, function, nargs):
-        self.write(f'call {function} {nargs}')
-
-    def write_call(self, function, nlocals):
-        self.write(f'call {function} {nlocals}')
+        self.write('call', function, str(nargs))
 
     def write_return(self):
         self.write('return')
 
     def write_function(self, name, nlocals):
-        self.write(f'function {name} {nlocals}')
+        self.write('function', name, str(nlocals))
 
-    def write(self, cmd):
-        self.file.write(cmd+'\n')
+    def write(self, *words):
+        self.commands.append(words)
+
+    @contextmanager
+    def capture(self):
+        "Move the commands written in the block out of the output into a list."
+        start = len(self.commands)
+        captured = []
+        yield captured
+        captured.extend(self.commands[start:])
+        del self.commands[start:]
+
+    def text(self):
+        return ''.join(' '.join(words) + '\n' for words in self.commands)
 
     def close(self):
-        self.file.close()
+        "Write the buffered commands to the file in one call."
+        if self.filename is not None and not self.closed:
+            with open(self.filename, 'w') as f:
+                f.write(self.text())
+        self.closed = True
+
+    def __enter__(self):
+        return self
 
-    def __del__(self):
-        self.close()
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None: self.close()
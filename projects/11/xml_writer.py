@@ -0,0 +1,204 @@
+"""Write a parsed Jack class as the XML parse tree of projects/10.
+
+Punctuation is not kept in the syntax tree, so it is regenerated from
+the structure of each node.
+"""
+
+from jack_ast import Visitor
+
+XML_ESCAPE = {'>': '&gt;', '<': '&lt;', '"': '&quot;', '&': '&amp;'}
+TYPE_KEYWORDS = {'int', 'char', 'boolean', 'void'}
+
+class XMLWriter(Visitor):
+    def __init__(self, fileout):
+        self.fileout = fileout
+        self.depth = 0
+
+    def open_tag(self, tag):
+        print('  '*self.depth + f'<{tag}>', file=self.fileout)
+        self.depth += 1
+
+    def close_tag(self, tag):
+        self.depth -= 1
+        print('  '*self.depth + f'</{tag}>', file=self.fileout)
+
+    def terminal(self, tag, value):
+        value = XML_ESCAPE.get(value, value)
+        print('  '*self.depth + f'<{tag}> {value} </{tag}>', file=self.fileout)
+
+    def keyword(self, value):
+        self.terminal('keyword', value)
+
+    def symbol(self, value):
+        self.terminal('symbol', value)
+
+    def identifier(self, value):
+        self.terminal('identifier', value)
+
+    def type(self, value):
+        self.terminal('keyword' if value in TYPE_KEYWORDS else 'identifier', value)
+
+    def names(self, names):
+        for i, name in enumerate(names):
+            if i: self.symbol(',')
+            self.identifier(name)
+        self.symbol(';')
+
+    def visit_Class(self, node):
+        self.open_tag('class')
+        self.keyword('class')
+        self.identifier(node.name)
+        self.symbol('{')
+        for dec in node.class_vars + node.subroutines:
+            self.visit(dec)
+        self.symbol('}')
+        self.close_tag('class')
+
+    def visit_ClassVarDec(self, node):
+        self.open_tag('classVarDec')
+        self.keyword(node.kind)
+        self.type(node.type)
+        self.names(node.names)
+        self.close_tag('classVarDec')
+
+    def visit_SubroutineDec(self, node):
+        self.open_tag('subroutineDec')
+        self.keyword(node.kind)
+        self.type(node.return_type)
+        self.identifier(node.name)
+        self.symbol('(')
+        self.open_tag('parameterList')
+        for i, (var_type, name) in enumerate(node.parameters):
+            if i: self.symbol(',')
+            self.type(var_type)
+            self.identifier(name)
+        self.close_tag('parameterList')
+        self.symbol(')')
+        self.open_tag('subroutineBody')
+        self.symbol('{')
+        for dec in node.locals:
+            self.visit(dec)
+        self.statements(node.statements)
+        self.symbol('}')
+        self.close_tag('subroutineBody')
+        self.close_tag('subroutineDec')
+
+    def visit_VarDec(self, node):
+        self.open_tag('varDec')
+        self.keyword('var')
+        self.type(node.type)
+        self.names(node.names)
+        self.close_tag('varDec')
+
+    def statements(self, statements):
+        self.open_tag('statements')
+        for statement in statements:
+            self.visit(statement)
+        self.close_tag('statements')
+
+    def block(self, statements):
+        self.symbol('{')
+        self.statements(statements)
+        self.symbol('}')
+
+    def visit_LetStatement(self, node):
+        self.open_tag('letStatement')
+        self.keyword('let')
+        self.identifier(node.name)
+        if node.index is not None:
+            self.symbol('[')
+            self.visit(node.index)
+            self.symbol(']')
+        self.symbol('=')
+        self.visit(node.value)
+        self.symbol(';')
+        self.close_tag('letStatement')
+
+    def visit_IfStatement(self, node):
+        self.open_tag('ifStatement')
+        self.keyword('if')
+        self.symbol('(')
+        self.visit(node.condition)
+        self.symbol(')')
+        self.block(node.statements)
+        if node.else_statements is not None:
+            self.keyword('else')
+            self.block(node.else_statements)
+        self.close_tag('ifStatement')
+
+    def visit_WhileStatement(self, node):
+        self.open_tag('whileStatement')
+        self.keyword('while')
+        self.symbol('(')
+        self.visit(node.condition)
+        self.symbol(')')
+        self.block(node.statements)
+        self.close_tag('whileStatement')
+
+    def visit_DoStatement(self, node):
+        self.open_tag('doStatement')
+        self.keyword('do')
+        self.visit(node.call)
+        self.symbol(';')
+        self.close_tag('doStatement')
+
+    def visit_ReturnStatement(self, node):
+        self.open_tag('returnStatement')
+        self.keyword('return')
+        if node.value is not None: self.visit(node.value)
+        self.symbol(';')
+        self.close_tag('returnStatement')
+
+    def visit_Expression(self, node):
+        self.open_tag('expression')
+        self.term(node.terms[0])
+        for op, term in zip(node.ops, node.terms[1:]):
+            self.symbol(op)
+            self.term(term)
+        self.close_tag('expression')
+
+    def term(self, node):
+        self.open_tag('term')
+        self.visit(node)
+        self.close_tag('term')
+
+    def visit_IntegerConstant(self, node):
+        self.terminal('integerConstant', str(node.value))
+
+    def visit_StringConstant(self, node):
+        self.terminal('stringConstant', node.value)
+
+    def visit_KeywordConstant(self, node):
+        self.keyword(node.value)
+
+    def visit_VarName(self, node):
+        self.identifier(node.name)
+
+    def visit_ArrayAccess(self, node):
+        self.identifier(node.name)
+        self.symbol('[')
+        self.visit(node.index)
+        self.symbol(']')
+
+    def visit_SubroutineCall(self, node):
+        "The tokens of a subroutine call, which are not wrapped in a tag."
+        if node.receiver is not None:
+            (self.keyword if node.receiver == 'this' else self.identifier)(node.receiver)
+            self.symbol('.')
+        self.identifier(node.name)
+        self.symbol('(')
+        self.open_tag('expressionList')
+        for i, argument in enumerate(node.arguments):
+            if i: self.symbol(',')
+            self.visit(argument)
+        self.close_tag('expressionList')
+        self.symbol(')')
+
+    def visit_ParenExpression(self, node):
+        self.symbol('(')
+        self.visit(node.expression)
+        self.symbol(')')
+
+    def visit_UnaryOp(self, node):
+        self.symbol(node.op)
+        self.term(node.term)